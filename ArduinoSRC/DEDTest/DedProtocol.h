@@ -0,0 +1,100 @@
+// Reference decoder for the binary DED protocol sent by ded_protocol.py.
+//
+// Frame:   0xA5 0x5A LEN PAYLOAD[LEN] CHECKSUM   (CHECKSUM = LEN ^ every payload byte)
+// Payload: 0x01 rows cols chars[rows * cols]      full refresh (keyframe)
+//          0x02 row col count chars[count]        set chars at row/col
+//
+// Feed every received byte to DedDecoder::feed(). It returns true once a
+// complete, valid frame was applied; screen[] then holds the current text and
+// rowDirty[] tells which LCD rows need redrawing.
+#ifndef DED_PROTOCOL_H
+#define DED_PROTOCOL_H
+
+#ifndef DED_ROWS
+#define DED_ROWS 2
+#endif
+#ifndef DED_COLUMNS
+#define DED_COLUMNS 16
+#endif
+
+#define DED_SYNC1 0xA5
+#define DED_SYNC2 0x5A
+#define DED_OP_FULL_REFRESH 0x01
+#define DED_OP_SET_CHARS 0x02
+
+class DedDecoder {
+public:
+  char screen[DED_ROWS][DED_COLUMNS + 1];
+  bool rowDirty[DED_ROWS];
+  bool synced;
+
+  DedDecoder() : synced(false), state(WAIT_SYNC1), length(0), received(0) {
+    for (uint8_t row = 0; row < DED_ROWS; row++) {
+      memset(screen[row], ' ', DED_COLUMNS);
+      screen[row][DED_COLUMNS] = '\0';
+      rowDirty[row] = true;
+    }
+  }
+
+  bool feed(uint8_t b) {
+    switch (state) {
+      case WAIT_SYNC1:
+        if (b == DED_SYNC1) state = WAIT_SYNC2;
+        return false;
+      case WAIT_SYNC2:
+        state = (b == DED_SYNC2) ? READ_LENGTH : (b == DED_SYNC1 ? WAIT_SYNC2 : WAIT_SYNC1);
+        return false;
+      case READ_LENGTH:
+        length = b;
+        received = 0;
+        checksum = b;
+        state = length ? READ_PAYLOAD : READ_CHECKSUM;
+        return false;
+      case READ_PAYLOAD:
+        payload[received++] = b;
+        checksum ^= b;
+        if (received == length) state = READ_CHECKSUM;
+        return false;
+      case READ_CHECKSUM:
+        state = WAIT_SYNC1;
+        return b == checksum && apply();
+    }
+    return false;
+  }
+
+private:
+  enum State { WAIT_SYNC1, WAIT_SYNC2, READ_LENGTH, READ_PAYLOAD, READ_CHECKSUM };
+  State state;
+  uint8_t length;
+  uint8_t received;
+  uint8_t checksum;
+  uint8_t payload[255];
+
+  bool apply() {
+    uint8_t i = 0;
+    while (i < length) {
+      uint8_t op = payload[i];
+      if (op == DED_OP_FULL_REFRESH && i + 3 <= length) {
+        uint8_t rows = payload[i + 1], cols = payload[i + 2];
+        if (rows != DED_ROWS || cols != DED_COLUMNS || i + 3 + rows * cols > length) return false;
+        for (uint8_t row = 0; row < rows; row++) {
+          memcpy(screen[row], &payload[i + 3 + row * cols], cols);
+          rowDirty[row] = true;
+        }
+        synced = true;
+        i += 3 + rows * cols;
+      } else if (op == DED_OP_SET_CHARS && i + 4 <= length) {
+        uint8_t row = payload[i + 1], col = payload[i + 2], count = payload[i + 3];
+        if (row >= DED_ROWS || col + count > DED_COLUMNS || i + 4 + count > length) return false;
+        memcpy(&screen[row][col], &payload[i + 4], count);
+        rowDirty[row] = true;
+        i += 4 + count;
+      } else {
+        return false;
+      }
+    }
+    return true;
+  }
+};
+
+#endif
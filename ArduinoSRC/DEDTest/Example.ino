@@ -2,6 +2,13 @@
 #define DCSBIOS_DEFAULT_SERIAL
 #include "DcsBios.h"
 
+// Uncomment when the DED entry in config.json uses "protocol": "binary"
+//#define DED_BINARY_PROTOCOL
+#ifdef DED_BINARY_PROTOCOL
+#include "DedProtocol.h"
+DedDecoder dedDecoder;
+#endif
+
 // Initialize the library by associating any needed LCD interface pin
 // with the Arduino pin number it is connected to
 const int rs = 12, en = 11, d4 = 5, d5 = 4, d6 = 3, d7 = 2;
@@ -27,6 +34,21 @@ void setup() {
 }
 
 void loop() {
+#ifdef DED_BINARY_PROTOCOL
+  while (Serial.available() > 0) {
+    if (dedDecoder.feed(Serial.read())) {
+      for (uint8_t row = 0; row < DED_ROWS; row++) {
+        if (dedDecoder.rowDirty[row]) {
+          lcd.setCursor(0, row);
+          lcd.print(dedDecoder.screen[row]);
+          dedDecoder.rowDirty[row] = false;
+        }
+      }
+    }
+  }
+  DcsBios::PollingInput::pollInputs();
+  return;
+#endif
   
   
   static String incomingString = "";
@@ -1,17 +1,33 @@
-import keyboard
-import time
-import pyvjoy
+from key_injector import KeyInjector, build_chord
+from keyfile_compiler import load_keyfile_index
+from axis_pipeline import AxisPipeline, scale_value
+from mapping_engine import MappingEngine, ACTION_KEY, ACTION_AXIS
+from log import get_logger
+
+log = get_logger("keys")
 
 class FalconBMSHandler:
-    def __init__(self):
+    def __init__(self, injector_backend=None, axes_config=None, mappings_path='mappings.json'):
         self.key_mappings = self.load_keyfile('keyfile.txt')
-        self.key_mappings = self.convert_keymap(self.key_mappings, self.hex_to_key)
+        # Chord strings ("ctrl+shift+x") are built once here instead of per key press
+        self.chords = {
+            callback: build_chord(key, modifier)
+            for callback, (key, modifier) in self.key_mappings.items()
+            if modifier.isdigit() and int(modifier) < 8
+        }
+        self.injector = KeyInjector(injector_backend)
         #print(keyboard._keyboard_event.canonical_names)
         #print(self.key_mappings)
-        self.pot_mappings = {
-            "ICP_HUD_BRT_KNB": pyvjoy.HID_USAGE_X,
-        }
-        self.joy = pyvjoy.VJoyDevice(1)  # Initialize vJoy device
+        # Potentiometer -> vJoy axis table, see "axes" in config.json.
+        # vJoy devices are opened on first use.
+        self.axes = AxisPipeline.from_config(axes_config)
+        # DCS-BIOS control -> BMS action table, compiled straight to chords
+        self.mappings = MappingEngine.from_file(mappings_path, self.chords)
+        for control in self.axes.axes:
+            if control not in self.mappings.index:
+                self.mappings.add({"control": control, "type": "axis"})
+        if self.mappings.unresolved:
+            print(f"Mapped callbacks without a key binding: {', '.join(self.mappings.unresolved)}")
 
 
     hex_to_key = {
@@ -96,81 +112,37 @@ class FalconBMSHandler:
         "0xd2": 'insert'
     }
 
-    dcsbios_to_bms_mappings = {
-        "ICP_BTN_6 1": "SimICPStpt",
-        "ICP_BTN_6 0": "",
-    }
-
     def load_keyfile(self, filepath):
-        key_mappings = {}
-        with open(filepath, 'r') as file:
-            print("Loading key mappings...") # Debugging
-            for line in file:
-                if not line.startswith("#") and " -1 " not in line:
-                    parts = line.split()
-                    callback = parts[0]
-                    key = parts[3]
-                    modifier = parts[4]
-                    key_mappings[callback] = (key, modifier)
+        # Compiled index, cached next to the keyfile and rebuilt only when it changes
+        self.keyfile_index = load_keyfile_index(filepath, self.hex_to_key)
+        key_mappings = self.keyfile_index.key_mappings()
         print(f"Loaded {len(key_mappings)} key mappings.") # Debugging
+        if self.keyfile_index.unresolved:
+            scan_codes = ", ".join(sorted(self.keyfile_index.unresolved))
+            print(f"No key name for scan codes: {scan_codes}")
         return key_mappings
 
-    def convert_keymap(self, keymap, hex_to_key):
-        converted = {}
-        for action, (hex_code, state) in keymap.items():
-            key_name = hex_to_key.get(hex_code.lower())
-            if key_name:
-                converted[action] = (key_name, state)
-        return converted
-
-    def send_key(self, DCSBIOS_callback):
-        if DCSBIOS_callback in self.dcsbios_to_bms_mappings:
-            callback = self.dcsbios_to_bms_mappings[DCSBIOS_callback]
-            if callback == "":
-                return
-            key, modifier = self.key_mappings[callback]
-            print(f"Sending key: {key} with modifier: {modifier}")
-            if modifier == "0":
-                keyboard.press_and_release(key)
-            elif modifier == "1":
-                keyboard.press_and_release('shift+' + key)
-            elif modifier == "2":
-                keyboard.press_and_release('ctrl+' + key)
-            elif modifier == "3":
-                keyboard.press_and_release('ctrl+shift+' + key)
-            elif modifier == "4":
-                keyboard.press_and_release('alt+' + key)
-            elif modifier == "5":
-                keyboard.press_and_release('shift+alt+' + key)
-            elif modifier == "6":
-                keyboard.press_and_release('ctrl+alt+' + key)
-            elif modifier == "7":
-                keyboard.press_and_release('ctrl+shift+alt+' + key)
-            time.sleep(0.01)  # Delay to simulate realistic key press timing
-        else:
-            # If not found in key mappings, check potentiometer mappings
-            action_parts = DCSBIOS_callback.split()
-            pot_name = action_parts[0]
-            # WE SHOULD GET THE VALUE FROM THE DICT HERE:
-            axis_code = self.pot_mappings.get(pot_name)
+    def send_key(self, DCSBIOS_callback, stamp=None):
+        action = self.mappings.lookup(DCSBIOS_callback)
+        if action is None:
+            log.warning("Callback '%s' not found in key or potentiometer mappings.", DCSBIOS_callback)
+        elif action[0] == ACTION_KEY:
+            chord = action[1]
+            log.debug("Sending key: %s", chord)
+            if not self.injector.inject(chord, stamp):
+                log.warning("Key queue full, dropped '%s'", chord)
+        elif action[0] == ACTION_AXIS:
+            self.send_pot_value(action[1], action[2])
 
-            if pot_name in self.pot_mappings:
-                value = int(action_parts[1])
-                self.send_pot_value(axis_code, value)
-            else:
-                print(f"Callback '{DCSBIOS_callback}' not found in key or potentiometer mappings.")
+    def send_pot_value(self, pot_name, value):
+        # Only records the latest value, flush_axes() pushes it to vJoy
+        self.axes.update(pot_name, value)
 
-    def send_pot_value(self, axis_code, value):
-        value = self.scale_value(value)
-        print(value)
-        value_hex = hex(value)
-        self.joy.set_axis(axis_code, value)
-        print(f"Set {axis_code} to {value_hex}")
+    def flush_axes(self):
+        self.axes.flush()
 
     def scale_value(self, value):
-        # Scale value from 0-65534 to 1-32768
-        scaled_value = int((value / 65534) * 32767) + 1
-        return scaled_value
+        return scale_value(value)
 
     def notify(self, message):
         print("[Falcon-BCC]: {}".format(message))
@@ -0,0 +1,153 @@
+import threading
+
+# vJoy axis name -> (HID usage, field of the vJoy position struct)
+VJOY_AXES = {
+    "X": (0x30, "wAxisX"),
+    "Y": (0x31, "wAxisY"),
+    "Z": (0x32, "wAxisZ"),
+    "RX": (0x33, "wAxisXRot"),
+    "RY": (0x34, "wAxisYRot"),
+    "RZ": (0x35, "wAxisZRot"),
+    "SL0": (0x36, "wSlider"),
+    "SL1": (0x37, "wDial"),
+}
+
+# DCS-BIOS potentiometers send 0-65535, vJoy axes take 1-32768
+RAW_MAX = 65535
+VJOY_MIN = 1
+VJOY_MAX = 32768
+
+DEFAULT_AXES = [
+    {"control": "ICP_HUD_BRT_KNB", "device": 1, "axis": "X"},
+]
+
+
+def scale_value(value):
+    # Scale value from 0-65534 to 1-32768
+    value = min(max(value, 0), 65534)
+    return int((value / 65534) * 32767) + 1
+
+
+class Axis:
+    def __init__(self, control, device, axis, deadband=64, smoothing=0.0):
+        if axis not in VJOY_AXES:
+            raise ValueError(f"Unknown vJoy axis '{axis}' for {control}")
+        self.control = control
+        self.device = device
+        self.axis = axis
+        self.usage, self.field = VJOY_AXES[axis]
+        self.deadband = deadband  # In raw units, input changes smaller than this are ignored
+        self.alpha = 1.0 - smoothing  # smoothing 0 passes values straight through
+        self.target = None  # Latest accepted raw value, older unflushed ones are simply overwritten
+        self.filtered = None
+        self.sent = None
+        self.pending = False
+
+    def accept(self, raw_value):
+        # Deadband on the input, so pot noise never even wakes the filter.
+        # The end stops always get through so full travel stays reachable.
+        if self.target is not None and abs(raw_value - self.target) < self.deadband \
+                and raw_value not in (0, RAW_MAX):
+            return False
+        self.target = raw_value
+        self.pending = True
+        return True
+
+    def step(self):
+        # Advances the filter by one flush; returns the vJoy value to send or None
+        if self.filtered is None:
+            self.filtered = float(self.target)
+        else:
+            self.filtered += self.alpha * (self.target - self.filtered)
+        if abs(self.target - self.filtered) < 1.0:
+            self.filtered = float(self.target)
+            self.pending = False  # Settled, nothing more to do until new input
+
+        value = scale_value(int(round(self.filtered)))
+        if value == self.sent:
+            return None
+        self.sent = value
+        return value
+
+
+class AxisPipeline:
+    def __init__(self, axes, device_factory=None, on_update=None):
+        self.axes = {axis.control: axis for axis in axes}
+        self.device_factory = device_factory or self._vjoy_device
+        # Called whenever a flush is needed, e.g. to signal a rate-limited scheduler task
+        self.on_update = on_update
+        self.devices = {}
+        self.counters = {
+            "updates": 0,
+            "ignored": 0,
+            "flushes": 0,
+            "axis_writes": 0,
+        }
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, axes_config=None, device_factory=None):
+        axes = [
+            Axis(entry["control"], entry.get("device", 1), entry.get("axis", "X"),
+                 entry.get("deadband", 64), entry.get("smoothing", 0.0))
+            for entry in (axes_config if axes_config is not None else DEFAULT_AXES)
+        ]
+        return cls(axes, device_factory)
+
+    def _vjoy_device(self, device_id):
+        import pyvjoy
+        return pyvjoy.VJoyDevice(device_id)
+
+    def update(self, control, raw_value):
+        # Called for every pot line; only records the latest value.
+        # Returns False when control is not an axis.
+        axis = self.axes.get(control)
+        if axis is None:
+            return False
+        with self._lock:
+            self.counters["updates"] += 1
+            if not axis.accept(raw_value):
+                self.counters["ignored"] += 1
+                return True
+        if self.on_update:
+            self.on_update()
+        return True
+
+    def flush(self):
+        # Called at a fixed rate; pushes every changed axis, one update per device
+        changed = {}
+        settling = False
+        with self._lock:
+            for axis in self.axes.values():
+                if not axis.pending:
+                    continue
+                value = axis.step()
+                if value is not None:
+                    changed.setdefault(axis.device, []).append((axis, value))
+                settling = settling or axis.pending
+        for device_id, values in changed.items():
+            device = self.devices.get(device_id)
+            if device is None:
+                device = self.device_factory(device_id)
+                self.devices[device_id] = device
+            self._write(device, values)
+            self.counters["axis_writes"] += len(values)
+        if changed:
+            self.counters["flushes"] += 1
+        if settling and self.on_update:
+            # Smoothed axes still moving towards their target need another flush
+            self.on_update()
+
+    def _write(self, device, values):
+        data = getattr(device, "data", None)
+        if data is not None and hasattr(device, "update"):
+            # Whole-state update: one driver call for all changed axes
+            for axis, value in values:
+                setattr(data, axis.field, value)
+            device.update()
+        else:
+            for axis, value in values:
+                device.set_axis(axis.usage, value)
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,353 @@
+import argparse
+import contextlib
+import ctypes
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dcs_bios_reader import ProtocolParser, StringBuffer, IntegerBuffer
+from dcs_bios_passthrough import SYNC, END_OF_UPDATE, export_frames
+from falcon_bms_reader import FlightData, FlightData2, IntellivibeData, SharedMemoryReader, FileBackend
+from ded_handler import DEDHandler, DisplayDecoder
+from mapping_engine import MappingEngine
+from key_injector import KeyInjector, RecordingBackend
+
+# Micro-benchmarks for the hot paths, on synthetic but realistically sized
+# input. Every benchmark reports operations per second plus its own rates
+# (bytes/s, writes/s, lines/s), and two allocation figures from a separate
+# traced run: peak bytes allocated per operation and blocks still allocated
+# afterwards (growth there means something is being retained).
+#
+#   python benchmarks.py                     run everything, print results
+#   python benchmarks.py --save base.json    also save the results
+#   python benchmarks.py --compare base.json fail if anything got slower than
+#                                            the baseline by more than --threshold
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def ded_pages(count=64, seed=2):
+    rng = random.Random(seed)
+    alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .:/\x02"
+    pages = []
+    for _ in range(count):
+        data = FlightData()
+        # Written as raw 5 x 26 blocks, which is how DisplayDecoder reads them
+        lines = bytes(rng.choice(alphabet) for _ in range(5 * 26))
+        invert = bytes(rng.choice(b"  \x02") for _ in range(5 * 26))
+        ctypes.memmove(ctypes.addressof(data) + FlightData.DEDLines.offset, lines, len(lines))
+        ctypes.memmove(ctypes.addressof(data) + FlightData.Invert.offset, invert, len(invert))
+        pages.append(data)
+    return pages
+
+
+def mapping_entries(callbacks, seed=3):
+    # A keyfile-sized mapping table: one control per keyfile callback
+    rng = random.Random(seed)
+    entries = []
+    for i, callback in enumerate(callbacks):
+        kind = rng.choice(("button", "button", "toggle", "rotary"))
+        entry = {"control": f"CONTROL_{i}", "type": kind}
+        if kind == "button":
+            entry.update(press=callback, release="")
+        elif kind == "toggle":
+            entry["positions"] = {"0": callback, "2": callback}
+        else:
+            entry.update(inc=callback, dec=callback)
+        entries.append(entry)
+    return entries
+
+
+def mapping_lines(entries, count=20000, seed=4):
+    rng = random.Random(seed)
+    values = {"button": "1", "toggle": "2", "rotary": "INC"}
+    lines = []
+    for _ in range(count):
+        entry = rng.choice(entries)
+        lines.append(f"{entry['control']} {values[entry['type']]}")
+    return lines
+
+
+class Benchmark:
+    # setup() returns (run, ops, rates, cleanup): run() does the work once, ops
+    # is the number of operations per run, rates maps a unit to its amount per
+    # run and cleanup, if not None, releases what setup created
+    def __init__(self, name, unit, setup):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+
+    def measure(self, repeat=5, min_time=0.2):
+        run, ops, rates, cleanup = self.setup()
+        try:
+            run()  # Warm up caches and lazily built state
+            loops = 1
+            while True:
+                elapsed = self._time(run, loops)
+                if elapsed >= min_time:
+                    break
+                loops *= 2
+            best = min([elapsed] + [self._time(run, loops) for _ in range(repeat - 1)]) / loops
+            peak, retained = self._allocations(run)
+        finally:
+            if cleanup:
+                cleanup()
+        result = {
+            "unit": self.unit,
+            "ops_per_s": ops / best,
+            "ns_per_op": best / ops * 1e9,
+            "peak_bytes_per_op": peak / ops,
+            "retained_blocks": retained,
+        }
+        for unit, amount in rates.items():
+            result[unit + "_per_s"] = amount / best
+        return result
+
+    def _time(self, run, loops):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(loops):
+                run()
+            return time.perf_counter() - start
+        finally:
+            gc.enable()
+
+    def _allocations(self, run):
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        run()
+        gc.collect()
+        retained = sys.getallocatedblocks() - blocks - 1  # Less the int holding blocks
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            run()
+            peak = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+        return peak, retained
+
+
+def parser_feed():
+    stream, integer_addresses, string_addresses, writes = export_frames()
+    parser = ProtocolParser()
+    for address in integer_addresses[::4]:
+        IntegerBuffer(parser, address, 0xffff, 0, None)
+    for address in string_addresses:
+        StringBuffer(parser, address, 29, lambda s: None)
+    # Same slicing as the UDP receiver: one datagram per frame
+    datagrams = []
+    start = 0
+    while True:
+        end = stream.find(SYNC, start + len(SYNC))
+        datagrams.append(stream[start:len(stream) if end == -1 else end])
+        if end == -1:
+            break
+        start = end
+
+    def run():
+        for datagram in datagrams:
+            parser.feed(datagram)
+    return run, len(datagrams), {"bytes": len(stream), "writes": writes}, None
+
+
+def parser_process_byte():
+    stream, integer_addresses, string_addresses, writes = export_frames(frames=20)
+    parser = ProtocolParser()
+    for address in string_addresses:
+        StringBuffer(parser, address, 29, lambda s: None)
+    chunks = [stream[i:i + 1] for i in range(len(stream))]
+
+    def run():
+        for c in chunks:
+            parser.processByte(c)
+    return run, len(stream), {"bytes": len(stream), "writes": writes}, None
+
+
+def string_buffer_write():
+    parser = ProtocolParser()
+    buffer = StringBuffer(parser, 0x5000, 29, lambda s: None)
+    rng = random.Random(5)
+    writes = []
+    for _ in range(200):
+        for address in range(0x5000, 0x501e, 2):
+            writes.append((address, rng.randrange(0x2020, 0x7a7a)))
+        writes.append((END_OF_UPDATE, 0))
+    on_write = buffer.on_dcsbios_write
+
+    def run():
+        for address, data in writes:
+            on_write(address, data)
+    return run, len(writes), {"writes": len(writes)}, None
+
+
+def ded_decode():
+    pages = ded_pages()
+    decoder = DisplayDecoder()
+
+    def run():
+        for page in pages:
+            decoder.update(page)
+    return run, len(pages), {"pages": len(pages)}, None
+
+
+def ded_extract_lines():
+    pages = ded_pages()
+    extract = DEDHandler.extract_ded_lines
+
+    def run():
+        for page in pages:
+            extract(None, page)
+    return run, len(pages), {"pages": len(pages)}, None
+
+
+def shared_memory_read():
+    # One BMS tick: live views, a private FlightData copy and change dispatch
+    # over watched fields, against file backed areas
+    directory = tempfile.mkdtemp(prefix="bms-shm-")
+    for structure in (FlightData, FlightData2, IntellivibeData):
+        with open(os.path.join(directory, structure.name), "wb") as f:
+            f.write(bytes(ctypes.sizeof(structure)))
+    reader = SharedMemoryReader(FileBackend(directory))
+    for field in ("lightBits", "lightBits2", "lightBits3", "hsiBits", "DEDLines"):
+        reader.subscribe(FlightData, field, lambda value: None)
+    ticks = 1000
+
+    def run():
+        for _ in range(ticks):
+            reader.view(FlightData)
+            reader.view(FlightData2)
+            reader.view(IntellivibeData)
+            reader.snapshot(FlightData)
+            reader.dispatch_changes()
+
+    def cleanup():
+        reader.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    size = ctypes.sizeof(FlightData) + ctypes.sizeof(FlightData2) + ctypes.sizeof(IntellivibeData)
+    return run, ticks, {"bytes": ticks * size}, cleanup
+
+
+def mapping_lookup():
+    from BMSKeyHandler import FalconBMSHandler
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler = FalconBMSHandler(injector_backend=RecordingBackend())
+    handler.injector.stop()
+    entries = mapping_entries(sorted(handler.chords))
+    engine = MappingEngine(entries, handler.chords)
+    lines = mapping_lines(entries)
+    lookup = engine.lookup
+
+    def run():
+        for line in lines:
+            lookup(line)
+    return run, len(lines), {"lines": len(lines)}, None
+
+
+def send_key():
+    # FalconBMSHandler.send_key with a keyfile-sized table, into an unpaced
+    # recording injector; console output is discarded
+    from BMSKeyHandler import FalconBMSHandler
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler = FalconBMSHandler(injector_backend=RecordingBackend())
+    handler.injector.stop()
+    entries = mapping_entries(sorted(handler.chords))
+    handler.mappings = MappingEngine(entries, handler.chords)
+    lines = mapping_lines(entries, count=5000)
+    backend = RecordingBackend()
+    handler.injector = KeyInjector(backend, max_pending=0, key_interval=0)  # Unbounded queue
+    sink = io.StringIO()
+
+    def run():
+        with contextlib.redirect_stdout(sink):
+            for line in lines:
+                handler.send_key(line)
+            handler.injector.wait_idle()
+        sink.seek(0)
+        sink.truncate()
+        backend.events.clear()
+
+    def cleanup():
+        handler.injector.stop()
+    return run, len(lines), {"lines": len(lines)}, cleanup
+
+
+BENCHMARKS = [
+    Benchmark("parser_feed", "datagram", parser_feed),
+    Benchmark("parser_process_byte", "byte", parser_process_byte),
+    Benchmark("string_buffer_write", "write", string_buffer_write),
+    Benchmark("ded_decode", "page", ded_decode),
+    Benchmark("ded_extract_lines", "page", ded_extract_lines),
+    Benchmark("shared_memory_read", "tick", shared_memory_read),
+    Benchmark("mapping_lookup", "line", mapping_lookup),
+    Benchmark("send_key", "line", send_key),
+]
+
+
+def run_benchmarks(names=None, repeat=5, min_time=0.2):
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names and benchmark.name not in names:
+            continue
+        result = benchmark.measure(repeat, min_time)
+        results[benchmark.name] = result
+        rates = ", ".join(f"{value:,.0f} {key[:-6]}/s" for key, value in result.items()
+                          if key.endswith("_per_s") and key != "ops_per_s")
+        print(f"{benchmark.name:22} {result['ns_per_op']:>12,.0f} ns/{result['unit']:8} {rates}")
+        print(f"{'':22} {result['peak_bytes_per_op']:>12,.1f} peak bytes/{result['unit']}, "
+              f"{result['retained_blocks']} blocks retained")
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # Returns the names of benchmarks that lost more than threshold of their throughput
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        change = result["ops_per_s"] / base["ops_per_s"] - 1.0
+        marker = ""
+        if change < -threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:22} {change * 100:+7.1f}%{marker}")
+    return regressions
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Micro-benchmarks for the middleware hot paths")
+    arguments.add_argument("names", nargs="*", help="benchmarks to run, default all")
+    arguments.add_argument("--save", help="write results to this JSON file")
+    arguments.add_argument("--compare", help="baseline JSON file to compare against")
+    arguments.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                           help="allowed throughput loss before failing, default 0.10")
+    arguments.add_argument("--repeat", type=int, default=5)
+    arguments.add_argument("--min-time", type=float, default=0.2, help="seconds per timed run")
+    args = arguments.parse_args()
+
+    current = run_benchmarks(args.names, args.repeat, args.min_time)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline['timestamp']}), threshold {args.threshold:.0%}")
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,111 @@
+import ctypes
+import time
+
+from falcon_bms_reader import FlightData, FlightData2, IntellivibeData
+
+# Sim states worked out from IntellivibeData
+STATE_NO_SIM = "no_sim"  # Shared memory missing or BMS exiting
+STATE_UI = "ui"  # BMS running, but not in 3D
+STATE_PAUSED = "paused"
+STATE_FLYING = "flying"
+
+
+class AdaptivePoller:
+    # Decides on every BMS tick whether the tick is worth processing, and how
+    # often ticks should come at all. The sim state sets the rate: ticks run
+    # at active_rate while in 3D, paused or not, and at idle_rate otherwise,
+    # unless input from the pit came in during the last hold seconds. A tick
+    # is processed when any area changed since the last processed one, and at
+    # least every max_skip_interval seconds so keyframes and refreshes still
+    # go out. The raw bytes of every area are kept in previous, and the areas
+    # that changed in this tick in changed_areas, so the tick itself needs no
+    # second copy.
+    def __init__(self, reader, active_rate=50, idle_rate=2, hold=2.0, max_skip_interval=1.0, on_rate_change=None):
+        if active_rate <= 0 or idle_rate <= 0:
+            raise ValueError("BMS poll rates must be above 0")
+        self.reader = reader
+        self.active_rate = active_rate
+        self.idle_rate = idle_rate
+        self.hold = hold
+        self.max_skip_interval = max_skip_interval
+        self.on_rate_change = on_rate_change  # Called with the new rate, e.g. Scheduler.set_rate
+        self.rate = active_rate
+        self.state = STATE_NO_SIM
+        self.active_until = 0.0
+        self.last_processed = None
+        self.previous = {FlightData: None, FlightData2: None, IntellivibeData: None}
+        self.changed_areas = []
+        self.counters = {
+            "polls": 0,
+            "processed": 0,
+            "skipped": 0,
+            "forced": 0,
+            "idle_polls": 0,
+        }
+
+    def sim_state(self):
+        intellivibe = self.reader.view(IntellivibeData)
+        if intellivibe is None or intellivibe.IsExitGame:
+            return STATE_NO_SIM
+        if not intellivibe.In3D:
+            return STATE_UI
+        if intellivibe.IsPaused or intellivibe.IsFrozen:
+            return STATE_PAUSED
+        return STATE_FLYING
+
+    def changed(self):
+        # Raw compare of the mapped areas; a few KB memcmp per tick is cheaper
+        # than decoding anything
+        changed_areas = []
+        for structure in self.previous:
+            buffer = self.reader.buffer(structure)
+            if buffer is None:
+                continue
+            with buffer:
+                if len(buffer) < ctypes.sizeof(structure):
+                    continue
+                raw = bytes(buffer[:ctypes.sizeof(structure)])
+            if raw != self.previous[structure]:
+                self.previous[structure] = raw
+                changed_areas.append(structure)
+        self.changed_areas = changed_areas
+        return bool(changed_areas)
+
+    def activity(self, now=None):
+        # Input from the pit: go to full rate straight away
+        now = time.monotonic() if now is None else now
+        self.active_until = now + self.hold
+        self._set_rate(self.active_rate)
+
+    def poll(self, now=None):
+        # Returns True when this tick should be processed
+        now = time.monotonic() if now is None else now
+        self.counters["polls"] += 1
+        self.state = self.sim_state()
+        changed = self.changed()
+        active = self.state in (STATE_FLYING, STATE_PAUSED) or now < self.active_until
+        if not active:
+            self.counters["idle_polls"] += 1
+        self._set_rate(self.active_rate if active else self.idle_rate)
+
+        if changed:
+            self.counters["processed"] += 1
+        elif self.last_processed is None or now - self.last_processed >= self.max_skip_interval:
+            self.counters["forced"] += 1
+        else:
+            self.counters["skipped"] += 1
+            return False
+        self.last_processed = now
+        return True
+
+    def _set_rate(self, rate):
+        if rate != self.rate:
+            self.rate = rate
+            if self.on_rate_change:
+                self.on_rate_change(rate)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["state"] = self.state
+        stats["rate"] = self.rate
+        return stats
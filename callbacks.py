@@ -1,22 +1,36 @@
 from dcs_bios_reader import ProtocolParser, StringBuffer, IntegerBuffer
+from latency import tracer
 
 class Callbacks:
-    def __init__(self, parser, shared_data):
+    def __init__(self, parser, state, controls=None):
         self.parser = parser
-        self.shared_data = shared_data
+        # StateStore; values are staged here and published at the end of the frame
+        self.state = state
+        # ControlRegistry over the aircraft JSON, None when no JSON is configured
+        self.controls = controls
         self.setup_dcs_bios_callbacks()
 
     def setup_dcs_bios_callbacks(self):
-        # Setup callbacks for DED data (example addresses)
-        self.ded_line1 = StringBuffer(self.parser, 0x450a, 29, self.handle_ded_line1)  # Replace 0x1234 with actual address
-        self.ded_line2 = StringBuffer(self.parser, 0x4528, 29, self.handle_ded_line2)  # Replace 0x1248 with actual address
+        if self.controls is not None:
+            self.ded_line1 = self.controls.subscribe("DED_LINE_1", self.handle_ded_line1)
+            self.ded_line2 = self.controls.subscribe("DED_LINE_2", self.handle_ded_line2)
+            return
+        # Without the aircraft JSON fall back to the F-16C_50 DED addresses
+        self.ded_line1 = StringBuffer(self.parser, 0x450a, 29, self.handle_ded_line1)
+        self.ded_line2 = StringBuffer(self.parser, 0x4528, 29, self.handle_ded_line2)
 
     def handle_ded_line1(self, value):
-        # put data into shared_data under DCS key then DED_line1 key
-        self.shared_data["DCS"]["DED_line1"] = value
+        # stage data under the DCS group, DED_line1 key
+        self.state.stage("DCS", "DED_line1", value)
+        self.stamp_ded()
 
 
 
     def handle_ded_line2(self, value):
 
-        self.shared_data["DCS"]["DED_line2"] = value
+        self.state.stage("DCS", "DED_line2", value)
+        self.stamp_ded()
+
+    def stamp_ded(self):
+        # The first change of the frame stamps it
+        self.state.stage_first("DCS", "DED_stamp", tracer.origin("dcs"))
@@ -0,0 +1,90 @@
+import json
+from collections import namedtuple
+
+from dcs_bios_reader import StringBuffer, IntegerBuffer
+from file_cache import load_cached
+
+CACHE_VERSION = 2
+
+# One output of a control from the DCS-BIOS control reference JSON.
+# max_length is only meaningful for strings, mask/shift_by only for integers.
+ControlOutput = namedtuple("ControlOutput", ["name", "type", "address", "mask", "shift_by", "max_length"])
+
+
+def parse_control_reference(document):
+    # document is the parsed aircraft JSON: {category: {identifier: control}}.
+    # Outputs are indexed as identifier + suffix, which is how DCS-BIOS names them.
+    outputs = {}
+    for category in document.values():
+        for identifier, control in category.items():
+            for output in control.get("outputs", ()):
+                name = identifier + output.get("suffix", "")
+                outputs[name] = (
+                    name,
+                    output.get("type", "integer"),
+                    output["address"],
+                    output.get("mask", 0xffff),
+                    output.get("shift_by", 0),
+                    output.get("max_length", 0),
+                )
+    return outputs
+
+
+class ControlIndex:
+    def __init__(self, outputs):
+        self.outputs = outputs  # name -> plain tuple in ControlOutput order
+
+    @classmethod
+    def load(cls, path, cache_path=None):
+        # The aircraft JSON is several MB, so the parsed index is cached
+        # next to it (or at cache_path)
+        return cls(load_cached(
+            path,
+            lambda content: parse_control_reference(json.loads(content)),
+            CACHE_VERSION,
+            cache_path=cache_path,
+            description="control index cache",
+        ))
+
+    def get(self, name):
+        output = self.outputs.get(name)
+        return ControlOutput(*output) if output else None
+
+    def address_range(self, name):
+        # (first address, byte length) of the export memory a control occupies
+        output = self.get(name)
+        if output is None:
+            return None
+        if output.type == "string":
+            return output.address, output.max_length
+        return output.address, 2
+
+    def __contains__(self, name):
+        return name in self.outputs
+
+    def __len__(self):
+        return len(self.outputs)
+
+
+class ControlRegistry:
+    # Creates StringBuffer/IntegerBuffer objects on the first subscription to a
+    # control, so only controls something listens to cost anything per write.
+    def __init__(self, parser, index):
+        self.parser = parser
+        self.index = index
+        self.buffers = {}
+
+    def subscribe(self, name, callback):
+        buffer = self.buffers.get(name)
+        if buffer is not None:
+            buffer.callbacks.add(callback)
+            return buffer
+        output = self.index.get(name)
+        if output is None:
+            raise KeyError(f"Unknown DCS-BIOS output '{name}'")
+        if output.type == "string":
+            buffer = StringBuffer(self.parser, output.address, output.max_length, callback)
+        else:
+            buffer = IntegerBuffer(self.parser, output.address, output.mask, output.shift_by, callback)
+        self.buffers[name] = buffer
+        return buffer
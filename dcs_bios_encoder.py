@@ -0,0 +1,195 @@
+import json
+import time
+
+from dcs_bios_passthrough import SYNC, END_OF_UPDATE, WRITE_HEADER, WORD, split_run
+
+# Export bindings, see bms_export.json. The target is either an "output" name
+# resolved through the aircraft ControlIndex or an explicit address:
+#   {"output": "DED_LINE_3", "source": "FlightData.DEDLines", "row": 2}
+#   {"address": "0x450a", "length": 29, "source": "FlightData.DEDLines", "row": 0}
+#   {"output": "LIGHT_MASTER_CAUTION", "source": "FlightData.lightBits", "bit": "0x1"}
+#   {"address": "0x4400", "mask": "0xffff", "shift_by": 0, "source": "FlightData.rpm", "range": [0, 110]}
+# "bit" turns the source into 0/1, "range" scales a gauge linearly onto the full mask.
+
+
+def _int(value):
+    return int(value, 0) if isinstance(value, str) else value
+
+
+class StringBinding:
+    def __init__(self, address, length, getter):
+        self.address = address
+        self.length = length
+        self.getter = getter
+
+    def apply(self, image, sources):
+        value = self.getter(sources)
+        if value is None:
+            return
+        # StringBuffer stops at the first NUL, so pad with spaces like DCS does
+        data = bytes(value)[:self.length].replace(b'\x00', b' ').ljust(self.length, b' ')
+        image.write_bytes(self.address, data)
+
+
+class IntegerBinding:
+    def __init__(self, address, mask, shift_by, getter):
+        self.address = address
+        self.mask = mask
+        self.shift_by = shift_by
+        self.max_value = mask >> shift_by
+        self.getter = getter
+
+    def apply(self, image, sources):
+        value = self.getter(sources)
+        if value is None:
+            return
+        value = min(max(int(value), 0), self.max_value)
+        image.write_bits(self.address, self.mask, value << self.shift_by)
+
+
+class ExportImage:
+    # Shadow of the 64 KB DCS-BIOS export memory. Writes only mark a word
+    # dirty when its value really changes.
+    def __init__(self):
+        self.memory = bytearray(0x10000)
+        self.dirty = set()
+
+    def write_word(self, address, value):
+        if WORD.unpack_from(self.memory, address)[0] != value:
+            WORD.pack_into(self.memory, address, value)
+            self.dirty.add(address)
+
+    def write_bits(self, address, mask, value):
+        word = WORD.unpack_from(self.memory, address)[0]
+        self.write_word(address, (word & ~mask) | (value & mask))
+
+    def write_bytes(self, address, data):
+        if self.memory[address:address + len(data)] == data:
+            return
+        start = address & ~1
+        end = (address + len(data) + 1) & ~1
+        self.memory[address:address + len(data)] = data
+        self.dirty.update(range(start, end, 2))
+
+
+class ExportEncoder:
+    def __init__(self, bindings, refresh_interval=5.0, max_gap=2):
+        self.bindings = bindings
+        self.image = ExportImage()
+        self.refresh_interval = refresh_interval
+        # Unchanged words between two dirty runs are resent when that is no
+        # longer than a write header (2 words), which saves bytes overall.
+        self.max_gap = max_gap
+        self.bound_words = set()
+        for binding in bindings:
+            if isinstance(binding, StringBinding):
+                self.bound_words.update(range(binding.address & ~1, (binding.address + binding.length + 1) & ~1, 2))
+            else:
+                self.bound_words.add(binding.address)
+        self.last_refresh = None
+        self.end_of_update = 0
+        self.frames = 0
+        self.bytes_sent = 0
+
+    @classmethod
+    def from_file(cls, path, index=None, refresh_interval=5.0):
+        with open(path, 'r') as f:
+            entries = json.load(f)
+        bindings = []
+        for entry in entries:
+            try:
+                bindings.append(build_binding(entry, index))
+            except (KeyError, ValueError) as e:
+                print(f"Skipping BMS export binding {entry}: {e}")
+        return cls(bindings, refresh_interval)
+
+    def encode(self, sources, now=None):
+        # sources maps structure names ("FlightData", ...) to current data.
+        # Returns one complete DCS-BIOS frame with only the changed words.
+        now = time.monotonic() if now is None else now
+        for binding in self.bindings:
+            binding.apply(self.image, sources)
+        if self.last_refresh is None or now - self.last_refresh >= self.refresh_interval:
+            # Periodic full refresh so boards that were reset catch up
+            self.image.dirty.update(self.bound_words)
+            self.last_refresh = now
+        frame = self.build_frame()
+        self.frames += 1
+        self.bytes_sent += len(frame)
+        return frame
+
+    def build_frame(self):
+        memory = self.image.memory
+        parts = [SYNC]
+        for start, end in self._runs(sorted(self.image.dirty)):
+            for address, data in split_run(start, bytes(memory[start:end])):
+                parts.append(WRITE_HEADER.pack(address, len(data)))
+                parts.append(data)
+        self.image.dirty.clear()
+        self.end_of_update = (self.end_of_update + 1) & 0xffff
+        parts.append(WRITE_HEADER.pack(END_OF_UPDATE, 2))
+        parts.append(WORD.pack(self.end_of_update))
+        return b''.join(parts)
+
+    def _runs(self, addresses):
+        start = end = None
+        for address in addresses:
+            if start is not None and address <= end + 2 * self.max_gap:
+                end = address + 2
+                continue
+            if start is not None:
+                yield start, end
+            start, end = address, address + 2
+        if start is not None:
+            yield start, end
+
+
+def build_getter(entry):
+    structure, _, field = entry["source"].partition(".")
+    row = entry.get("row")
+    bit = _int(entry.get("bit")) if "bit" in entry else None
+
+    def getter(sources):
+        data = sources.get(structure)
+        if data is None:
+            return None
+        value = getattr(data, field)
+        if row is not None:
+            value = value[row]
+        if bit is not None:
+            return 1 if value & bit else 0
+        return value
+    return getter
+
+
+def build_binding(entry, index=None):
+    if "output" in entry:
+        if index is None:
+            raise ValueError("needs dcs_bios.aircraft_json in config.json")
+        output = index.get(entry["output"])
+        if output is None:
+            raise KeyError(f"unknown DCS-BIOS output '{entry['output']}'")
+        kind, address = output.type, output.address
+        length, mask, shift_by = output.max_length, output.mask, output.shift_by
+    else:
+        address = _int(entry["address"])
+        kind = "string" if "length" in entry else "integer"
+        length = _int(entry.get("length", 0))
+        mask, shift_by = _int(entry.get("mask", 0xffff)), entry.get("shift_by", 0)
+
+    getter = build_getter(entry)
+    if kind == "string":
+        return StringBinding(address, length, getter)
+    binding = IntegerBinding(address, mask, shift_by, getter)
+    if "range" in entry:
+        # Gauge: stretch the source's [low, high] over the output's full range
+        low, high = entry["range"]
+        if high == low:
+            raise ValueError(f"range {entry['range']} is empty")
+        scale = binding.max_value / (high - low)
+
+        def scaled(sources):
+            value = getter(sources)
+            return None if value is None else (value - low) * scale
+        binding.getter = scaled
+    return binding
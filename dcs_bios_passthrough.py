@@ -0,0 +1,163 @@
+import random
+import struct
+
+from latency import tracer
+
+SYNC = b'\x55\x55\x55\x55'
+END_OF_UPDATE = 0xfffe
+WRITE_HEADER = struct.Struct("<HH")
+WORD = struct.Struct("<H")
+
+
+def parse_address_ranges(arduino_config, index=None):
+    # "address_ranges": [[start, length], ...] with ints or "0x..." strings, and/or
+    # "controls": ["DED_LINE_1", ...] resolved through the aircraft ControlIndex.
+    # Returns sorted, merged, word aligned (start, end) pairs.
+    ranges = []
+    for start, length in arduino_config.get("address_ranges", ()):
+        start = int(start, 0) if isinstance(start, str) else start
+        length = int(length, 0) if isinstance(length, str) else length
+        ranges.append((start, start + length))
+    for name in arduino_config.get("controls", ()):
+        if index is None:
+            raise ValueError(f"Control '{name}' needs dcs_bios.aircraft_json in config.json")
+        address_range = index.address_range(name)
+        if address_range is None:
+            raise KeyError(f"Unknown DCS-BIOS output '{name}'")
+        start, length = address_range
+        ranges.append((start, start + length))
+
+    merged = []
+    for start, end in sorted((start & ~1, (end + 1) & ~1) for start, end in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_run(start, data):
+    # Yields (address, data) pieces of a run of little endian words. Receivers
+    # take four 0x55 bytes for a sync wherever they appear, so the run is cut
+    # in front of any word that would complete one. The write header that
+    # starts the next piece breaks the sequence, addresses and counts are even.
+    if SYNC not in data:
+        yield start, data
+        return
+    piece = 0
+    for offset in range(2, len(data), 2):
+        if SYNC in data[max(piece, offset - 3):offset + 2]:
+            yield start + piece, data[piece:offset]
+            piece = offset
+    yield start + piece, data[piece:]
+
+
+class DeviceStream:
+    # Collects the writes one device subscribed to during a DCS-BIOS frame and
+    # re-frames them as a valid DCS-BIOS export stream.
+    def __init__(self, name, connection, ranges):
+        self.name = name
+        self.connection = connection
+        self.ranges = ranges
+        self.runs = []  # [start address, bytearray of little endian words]
+        self.frames = 0
+        self.bytes_sent = 0
+
+    def on_write(self, address, data):
+        runs = self.runs
+        if runs and runs[-1][0] + len(runs[-1][1]) == address:
+            runs[-1][1] += WORD.pack(data)
+        else:
+            runs.append([address, bytearray(WORD.pack(data))])
+
+    def build_frame(self, end_of_update):
+        parts = [SYNC]
+        for start, data in self.runs:
+            for address, piece in split_run(start, bytes(data)):
+                parts.append(WRITE_HEADER.pack(address, len(piece)))
+                parts.append(piece)
+        # Arduino DCS-BIOS runs its end-of-update handlers on this write
+        parts.append(WRITE_HEADER.pack(END_OF_UPDATE, 2))
+        parts.append(WORD.pack(end_of_update))
+        self.runs = []
+        return b''.join(parts)
+
+    def flush(self, end_of_update, stamp=None):
+        frame = self.build_frame(end_of_update)
+        self.frames += 1
+        self.bytes_sent += len(frame)
+        # Unkeyed: every frame carries different writes, none may be coalesced away
+        self.connection.send_bytes(frame, stamp=stamp)
+
+
+class ExportForwarder:
+    # Forwards the parts of the DCS-BIOS export stream each Arduino cares
+    # about. Devices only register for their own address ranges in the
+    # parser's address index, so unrelated writes never reach them.
+    def __init__(self, parser, devices):
+        self.parser = parser
+        self.devices = devices
+        self.pending = False
+        self.stamp = None  # Stamp of the datagram or BMS tick that started the frame
+        self.last_end_of_update = 0
+        for device in devices:
+            for start, end in device.ranges:
+                parser.add_address_callback(start, end - start, self._device_writer(device))
+        parser.add_address_callback(END_OF_UPDATE, 1, self.on_end_of_update)
+        parser.frame_sync_callbacks.add(self.on_frame_sync)
+
+    def _device_writer(self, device):
+        on_write = device.on_write
+
+        def write(address, data):
+            if not self.pending:
+                self.pending = True
+                self.stamp = tracer.last
+            on_write(address, data)
+        return write
+
+    def on_end_of_update(self, address, data):
+        self.last_end_of_update = data
+        self.flush()
+
+    def on_frame_sync(self):
+        # A frame that did not end in an end-of-update write still gets forwarded
+        if self.pending:
+            self.flush()
+
+    def flush(self):
+        self.pending = False
+        for device in self.devices:
+            device.flush(self.last_end_of_update, self.stamp)
+        self.stamp = None
+
+    def stats(self):
+        return {device.name: {"frames": device.frames, "bytes": device.bytes_sent} for device in self.devices}
+
+
+def export_frames(controls=400, strings=5, frames=200, changes=0.2, seed=1):
+    # DCS-BIOS export stream for an aircraft with `controls` integer outputs
+    # and `strings` 29 character string outputs. The first frame writes
+    # everything, later frames the changed share of it, as DCS-BIOS does.
+    rng = random.Random(seed)
+    integer_addresses = [0x4400 + 2 * i for i in range(controls)]
+    string_addresses = [0x5000 + 30 * i for i in range(strings)]
+    stream = bytearray()
+    writes = 0
+    for frame in range(frames):
+        stream += SYNC
+        ratio = 1.0 if frame == 0 else changes
+        addresses = sorted(a for a in integer_addresses if rng.random() < ratio)
+        for address in addresses:
+            # Any value, 0x55 bytes included: they are common in real exports
+            # and take the parser off its bulk path
+            stream += WRITE_HEADER.pack(address, 2) + WORD.pack(rng.randrange(0x10000))
+            writes += 1
+        for address in string_addresses:
+            if frame == 0 or rng.random() < changes:
+                text = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ") for _ in range(30))
+                stream += WRITE_HEADER.pack(address, 30) + text.encode("latin-1")
+                writes += 15
+        stream += WRITE_HEADER.pack(END_OF_UPDATE, 2) + WORD.pack(frame & 0xffff)
+        writes += 1
+    return bytes(stream), integer_addresses, string_addresses, writes
@@ -0,0 +1,365 @@
+import ctypes
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from dcs_bios_reader import ProtocolParser, WRITE_PAIR
+from dcs_bios_receiver import DcsBiosReceiver
+from dcs_bios_encoder import ExportImage
+from dcs_bios_passthrough import END_OF_UPDATE, SYNC, export_frames
+from latency import tracer, LatencyHistogram
+from log import get_logger
+
+log = get_logger("dcs")
+
+# Ring layout in the shared memory block:
+#   write position, read position  two uint64 byte counts that only ever grow,
+#                                  each written by one side only
+#   STATS_FIELDS                   uint64 counters kept by the decoder process
+#   data                           capacity bytes of records
+# A record is RECORD_HEADER (payload length, monotonic time the frame's first
+# write was decoded) followed by WRITE_PAIR records, the last one being the
+# end-of-update write. A record never wraps; WRAP, or too little room for a
+# header, sends the reader back to the start of the data.
+STATS_FIELDS = ("datagrams", "bytes", "frames", "writes_in", "writes_out", "dropped_frames")
+POSITIONS_SIZE = 16
+DATA_OFFSET = POSITIONS_SIZE + 8 * len(STATS_FIELDS)
+RECORD_HEADER = struct.Struct("<Id")
+WRAP = 0xffffffff
+
+
+class SharedRing:
+    # Single producer, single consumer ring of variable sized records in a
+    # multiprocessing.shared_memory block. Positions are ctypes uint64s, so
+    # each update is one aligned store the other process sees whole.
+    def __init__(self, shm, capacity, owner=False):
+        self.shm = shm
+        self.capacity = capacity
+        self.owner = owner
+        self.buffer = shm.buf
+        self.write_position = ctypes.c_uint64.from_buffer(self.buffer, 0)
+        self.read_position = ctypes.c_uint64.from_buffer(self.buffer, 8)
+        self.counters = (ctypes.c_uint64 * len(STATS_FIELDS)).from_buffer(self.buffer, POSITIONS_SIZE)
+
+    @classmethod
+    def create(cls, capacity=1 << 20):
+        shm = shared_memory.SharedMemory(create=True, size=DATA_OFFSET + capacity)
+        shm.buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+        return cls(shm, capacity, owner=True)
+
+    @classmethod
+    def attach(cls, name, capacity):
+        try:
+            # Only the creating side may unlink; Python 3.13+ can say so
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, capacity)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put(self, payload, timestamp):
+        # Returns False when the reader is too far behind for the record to fit
+        capacity = self.capacity
+        write = self.write_position.value
+        free = capacity - (write - self.read_position.value)
+        size = RECORD_HEADER.size + len(payload)
+        position = write % capacity
+        tail = capacity - position
+        if size > tail:
+            if free < tail + size:
+                return False
+            if tail >= RECORD_HEADER.size:
+                RECORD_HEADER.pack_into(self.buffer, DATA_OFFSET + position, WRAP, 0.0)
+            write += tail
+            position = 0
+        elif free < size:
+            return False
+        start = DATA_OFFSET + position
+        RECORD_HEADER.pack_into(self.buffer, start, len(payload), timestamp)
+        self.buffer[start + RECORD_HEADER.size:start + size] = payload
+        # Published last, so the reader never sees a half written record
+        self.write_position.value = write + size
+        return True
+
+    def get(self):
+        # (timestamp, payload bytes) of the oldest record, or None
+        capacity = self.capacity
+        read = self.read_position.value
+        if read == self.write_position.value:
+            return None
+        position = read % capacity
+        tail = capacity - position
+        if tail < RECORD_HEADER.size or RECORD_HEADER.unpack_from(self.buffer, DATA_OFFSET + position)[0] == WRAP:
+            read += tail
+            position = 0
+        start = DATA_OFFSET + position
+        length, timestamp = RECORD_HEADER.unpack_from(self.buffer, start)
+        payload = bytes(self.buffer[start + RECORD_HEADER.size:start + RECORD_HEADER.size + length])
+        self.read_position.value = read + RECORD_HEADER.size + length
+        return timestamp, payload
+
+    def stats(self):
+        return dict(zip(STATS_FIELDS, self.counters))
+
+    def close(self):
+        # ctypes views have to go before the mapping can be closed
+        del self.write_position, self.read_position, self.counters
+        self.buffer = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class FrameCollector:
+    # Decoder process side: mirrors the export memory and at the end of each
+    # frame queues only the words that actually changed. Everything ever
+    # written is resent every refresh_interval seconds, like the DCS-BIOS
+    # stream itself does, so boards that were reset catch up.
+    def __init__(self, ring, wakeup, receiver=None, refresh_interval=5.0):
+        self.ring = ring
+        self.receiver = receiver
+        self.wakeup = wakeup
+        self.refresh_interval = refresh_interval
+        self.image = ExportImage()
+        self.known = set()
+        self.frame_started = None
+        self.last_refresh = time.monotonic()
+
+    def on_write(self, address, data):
+        if address == END_OF_UPDATE:
+            self.flush(data)
+            return
+        if self.frame_started is None:
+            self.frame_started = time.monotonic()
+        self.ring.counters[3] += 1
+        if address not in self.known:
+            # The image starts zeroed, so a first write of 0 would not count as a change
+            self.known.add(address)
+            self.image.dirty.add(address)
+        self.image.write_word(address, data)
+
+    def on_frame_sync(self):
+        # A frame that did not end in an end-of-update write
+        if self.image.dirty:
+            self.flush(None)
+
+    def flush(self, end_of_update):
+        now = time.monotonic()
+        dirty = self.image.dirty
+        if now - self.last_refresh >= self.refresh_interval:
+            dirty.update(self.known)
+            self.last_refresh = now
+        memory = self.image.memory
+        words = []
+        for address in sorted(dirty):
+            words.append(address)
+            words.append(memory[address] | memory[address + 1] << 8)
+        if end_of_update is not None:
+            words.append(END_OF_UPDATE)
+            words.append(end_of_update)
+        if not words:
+            return
+        payload = struct.pack("<%dH" % len(words), *words)
+        counters = self.ring.counters
+        if self.receiver is not None:
+            counters[0] = self.receiver.datagrams
+            counters[1] = self.receiver.bytes_received
+        if not self.ring.put(payload, self.frame_started or now):
+            # Keep the changes, they go out with the next frame that fits
+            counters[5] += 1
+            return
+        dirty.clear()
+        self.frame_started = None
+        counters[2] += 1
+        counters[4] += len(words) // 2
+        self.wakeup.release()
+
+
+def decoder_main(ring_name, capacity, wakeup, stop_event, config, refresh_interval):
+    # Entry point of the decoder process: UDP receive and byte parsing happen
+    # here, away from the GIL of the process running the handlers
+    ring = SharedRing.attach(ring_name, capacity)
+    parser = ProtocolParser()
+    receiver = DcsBiosReceiver.from_config(parser, stop_event, config)
+    receiver.poll_interval = min(receiver.poll_interval, 0.1)
+    collector = FrameCollector(ring, wakeup, receiver, refresh_interval)
+    parser.write_callbacks.add(collector.on_write)
+    parser.frame_sync_callbacks.add(collector.on_frame_sync)
+    try:
+        receiver.run()
+    except Exception as e:
+        log.exception("DCS decoder process stopped: %s", e)
+    finally:
+        ring.close()
+
+
+class DecoderProcess:
+    # Runs DcsBiosReceiver and ProtocolParser in a separate process. The
+    # process sends back only changed, already decoded writes through a
+    # SharedRing, and run() dispatches them to the callbacks registered on
+    # the local parser, so handlers work exactly as in threaded mode.
+    def __init__(self, parser, stop_event, config, capacity=1 << 20, poll_interval=0.25, refresh_interval=5.0):
+        self.parser = parser
+        self.stop_event = stop_event
+        self.config = config
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.ring = None
+        self.ring_stats = dict.fromkeys(STATS_FIELDS, 0)  # Last counters, kept once the ring is closed
+        self._ring_lock = threading.Lock()  # stats() runs on the scheduler thread
+        self.process = None
+        self.frames = 0
+        self.writes = 0
+        self.ring_latency = LatencyHistogram()  # Frame decoded in the worker -> dispatched here, in us
+
+    @classmethod
+    def from_config(cls, parser, stop_event, config):
+        dcs_bios = config.get("dcs_bios", {})
+        return cls(parser, stop_event, config, dcs_bios.get("ring_capacity", 1 << 20),
+                   dcs_bios.get("poll_interval", 0.25), dcs_bios.get("refresh_interval", 5.0))
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")  # What Windows does anyway
+        self.ring = SharedRing.create(self.capacity)
+        self.wakeup = context.Semaphore(0)
+        self.process_stop = context.Event()
+        self.process = context.Process(
+            target=decoder_main, name="dcs-bios-decoder", daemon=True,
+            args=(self.ring.name, self.capacity, self.wakeup, self.process_stop, self.config, self.refresh_interval))
+        self.process.start()
+        log.info("DCS-BIOS decoder process %d started", self.process.pid)
+
+    def run(self):
+        if self.process is None:
+            self.start()
+        try:
+            while not self.stop_event.is_set():
+                # One release per frame; draining may leave later ones spurious
+                self.wakeup.acquire(timeout=self.poll_interval)
+                self.drain()
+                if not self.process.is_alive():
+                    log.error("DCS-BIOS decoder process exited with code %s", self.process.exitcode)
+                    return
+        finally:
+            self.stop()
+
+    def drain(self):
+        get = self.ring.get
+        dispatch_writes = self.parser.dispatch_writes
+        while True:
+            record = get()
+            if record is None:
+                return
+            timestamp, payload = record
+            tracer.mark("dcs", timestamp)
+            self.parser.dispatch_frame_sync()
+            dispatch_writes(payload)
+            self.frames += 1
+            self.writes += len(payload) // WRITE_PAIR.size
+            self.ring_latency.record(max(0, int((time.monotonic() - timestamp) * 1e6)))
+
+    def stats(self):
+        with self._ring_lock:
+            if self.ring:
+                self.ring_stats = self.ring.stats()
+            stats = dict(self.ring_stats)
+        stats.update({
+            "dispatched_frames": self.frames,
+            "dispatched_writes": self.writes,
+            "ring_p50_ms": self.ring_latency.percentile(50) / 1000.0,
+            "ring_p99_ms": self.ring_latency.percentile(99) / 1000.0,
+        })
+        return stats
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process_stop.set()
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        with self._ring_lock:
+            self.ring_stats = self.ring.stats()
+            self.ring.close()
+            self.ring = None
+
+
+def compare_modes(frames=3000, rate=1000, port=5011, work_ms=0.5):
+    # Sends a synthetic export stream to a local port and measures, for the
+    # threaded receiver and for the decoder process: frames per second
+    # dispatched, send -> end-of-update dispatch latency, and how late a
+    # fixed slice of handler work in the main thread finishes (GIL contention)
+    from dcs_bios_reader import StringBuffer, IntegerBuffer
+    stream, integer_addresses, string_addresses, writes = export_frames(frames=frames)
+    datagrams = [SYNC + chunk for chunk in stream.split(SYNC)[1:]]
+    config = {"dcs_bios": {"port": port, "multicast_group": "239.255.50.10"}}
+
+    for mode in ("thread", "process"):
+        parser = ProtocolParser()
+        for address in integer_addresses[::4]:
+            IntegerBuffer(parser, address, 0xffff, 0, None)
+        for address in string_addresses:
+            StringBuffer(parser, address, 29, lambda s: None)
+        sent_at = {}
+        latency = LatencyHistogram()
+        received = []
+
+        def on_end_of_update(address, data):
+            latency.record(max(0, int((time.monotonic() - sent_at.get(data, time.monotonic())) * 1e6)))
+            received.append(data)
+        parser.add_address_callback(END_OF_UPDATE, 1, on_end_of_update)
+
+        stop = threading.Event()
+        if mode == "thread":
+            source = DcsBiosReceiver.from_config(parser, stop, config)
+        else:
+            source = DecoderProcess(parser, stop, config)
+            source.start()
+        thread = threading.Thread(target=source.run)
+        thread.start()
+        time.sleep(1.5)  # Socket bound, process imported
+
+        def send():
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            interval = 1.0 / rate
+            start = time.monotonic()
+            for i, datagram in enumerate(datagrams):
+                delay = start + i * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                sent_at[i & 0xffff] = time.monotonic()
+                s.sendto(datagram, ("127.0.0.1", port))
+            s.close()
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        # Stand-in for the handlers: pure Python work that should take work_ms
+        jitter = LatencyHistogram()
+        started = time.monotonic()
+        while sender.is_alive():
+            t = time.perf_counter()
+            deadline = t + work_ms / 1000.0
+            n = 0
+            while time.perf_counter() < deadline:
+                n += 1
+            jitter.record(int((time.perf_counter() - deadline) * 1e6))
+        elapsed = time.monotonic() - started
+        time.sleep(0.5)
+        stop.set()
+        thread.join()
+        print(f"{mode:8} {len(received) / elapsed:8.0f} frames/s of {rate}, "
+              f"latency p50 {latency.percentile(50) / 1000:.2f}ms p99 {latency.percentile(99) / 1000:.2f}ms "
+              f"max {latency.max / 1000:.2f}ms, main thread overrun p99 {jitter.percentile(99) / 1000:.2f}ms "
+              f"max {jitter.max / 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    compare_modes()
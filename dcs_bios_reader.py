@@ -9,61 +9,226 @@ else:
     def byte2int(b):
         return b[0]
 
+import re
 import struct
 
 
+WAIT_FOR_SYNC = 0
+ADDRESS_LOW = 1
+ADDRESS_HIGH = 2
+COUNT_LOW = 3
+COUNT_HIGH = 4
+DATA_LOW = 5
+DATA_HIGH = 6
+
+SYNC_BYTE = 0x55
+SYNC_PATTERN = re.compile(b"\x55")
+
+# One already decoded write: address, data word
+WRITE_PAIR = struct.Struct("<HH")
+
+
+def _memoryview_find(view):
+    # bytes.find(b"\x55", ...) for memoryviews, which have no find; re
+    # searches any buffer
+    search = SYNC_PATTERN.search
+
+    def find(sub, start, end):
+        match = search(view, start, end)
+        return match.start() if match else -1
+    return find
+
+
 class ProtocolParser:
     def __init__(self):
-        self.__state = "WAIT_FOR_SYNC"
+        self.__state = WAIT_FOR_SYNC
         self.__sync_byte_count = 0
         self.__address = 0
         self.__count = 0
         self.__data = 0
         self.write_callbacks = set()
+        self.address_callbacks = {}
         self.frame_sync_callbacks = set()
 
+    def add_address_callback(self, address, length, callback):
+        # Register callback for writes to any address in [address, address + length).
+        # Only the buffers indexed under a written address are called for it.
+        for a in range(address, address + max(length, 1)):
+            self.address_callbacks.setdefault(a, []).append(callback)
+
+    def remove_address_callback(self, address, length, callback):
+        for a in range(address, address + max(length, 1)):
+            callbacks = self.address_callbacks.get(a)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.address_callbacks[a]
+
+    def dispatch_writes(self, buffer):
+        # Runs the callbacks for writes decoded elsewhere, e.g. by a decoder
+        # process, given as packed WRITE_PAIR records. No state machine involved.
+        write_callbacks = self.write_callbacks
+        address_callbacks = self.address_callbacks
+        for address, data in WRITE_PAIR.iter_unpack(buffer):
+            callbacks = address_callbacks.get(address)
+            if callbacks:
+                for callback in callbacks:
+                    callback(address, data)
+            for callback in write_callbacks:
+                callback(address, data)
+
+    def dispatch_frame_sync(self):
+        for callback in self.frame_sync_callbacks:
+            callback()
+
     def processByte(self, c):
+        # Byte at a time, for callers that read a serial port or similar.
+        # Same state machine as feed(), without its per-call setup.
         c = byte2int(c)
-        if self.__state == "ADDRESS_LOW":
+        state = self.__state
+        if state == ADDRESS_LOW:
             self.__address = c
-            self.__state = "ADDRESS_HIGH"
-        elif self.__state == "ADDRESS_HIGH":
+            self.__state = ADDRESS_HIGH
+        elif state == ADDRESS_HIGH:
             self.__address += c * 256
             if self.__address != 0x5555:
-                self.__state = "COUNT_LOW"
+                self.__state = COUNT_LOW
             else:
-                self.__state = "WAIT_FOR_SYNC"
-        elif self.__state == "COUNT_LOW":
+                self.__state = WAIT_FOR_SYNC
+        elif state == COUNT_LOW:
             self.__count = c
-            self.__state = "COUNT_HIGH"
-        elif self.__state == "COUNT_HIGH":
+            self.__state = COUNT_HIGH
+        elif state == COUNT_HIGH:
             self.__count += 256 * c
-            self.__state = "DATA_LOW"
-        elif self.__state == "DATA_LOW":
+            self.__state = DATA_LOW
+        elif state == DATA_LOW:
             self.__data = c
             self.__count -= 1
-            self.__state = "DATA_HIGH"
-        elif self.__state == "DATA_HIGH":
-            self.__data += 256 * c
+            self.__state = DATA_HIGH
+        elif state == DATA_HIGH:
+            address = self.__address
+            data = self.__data + 256 * c
+            self.__data = data
             self.__count -= 1
+            callbacks = self.address_callbacks.get(address)
+            if callbacks:
+                for callback in callbacks:
+                    callback(address, data)
             for callback in self.write_callbacks:
-                callback(self.__address, self.__data)
-            self.__address += 2
+                callback(address, data)
+            self.__address = address + 2
             if self.__count == 0:
-                self.__state = "ADDRESS_LOW"
+                self.__state = ADDRESS_LOW
             else:
-                self.__state = "DATA_LOW"
+                self.__state = DATA_LOW
 
-        if c == 0x55:
+        if c == SYNC_BYTE:
             self.__sync_byte_count += 1
+            if self.__sync_byte_count == 4:
+                self.__state = ADDRESS_LOW
+                self.__sync_byte_count = 0
+                for callback in self.frame_sync_callbacks:
+                    callback()
         else:
             self.__sync_byte_count = 0
 
-        if self.__sync_byte_count == 4:
-            self.__state = "ADDRESS_LOW"
-            self.__sync_byte_count = 0
-            for callback in self.frame_sync_callbacks:
-                callback()
+    def feed(self, buffer):
+        # Decode a whole datagram in one call. Data words are unpacked in bulk
+        # up to the next sync byte; the word holding it, and everything that
+        # is not data, goes through the byte state machine. State is kept
+        # across calls, so a datagram may end anywhere inside a write.
+        if isinstance(buffer, (bytes, bytearray)):
+            find = buffer.find
+        else:
+            # e.g. a memoryview of the receiver's reused buffer: decoded and
+            # searched in place rather than copied
+            buffer = memoryview(buffer).cast("B")
+            find = _memoryview_find(buffer)
+        state = self.__state
+        sync_byte_count = self.__sync_byte_count
+        address = self.__address
+        count = self.__count
+        data = self.__data
+        write_callbacks = self.write_callbacks
+        address_callbacks = self.address_callbacks
+        end = len(buffer)
+        i = 0
+
+        while i < end:
+            if state == DATA_LOW and count >= 2:
+                words = min(count >> 1, (end - i) >> 1)
+                sync = find(b"\x55", i, i + 2 * words)
+                if sync != -1:
+                    # Only whole words before the sync byte, so a 0x55 still
+                    # counts towards a sync sequence
+                    words = (sync - i) >> 1
+                if words:
+                    for value in struct.unpack_from("<%dH" % words, buffer, i):
+                        callbacks = address_callbacks.get(address)
+                        if callbacks:
+                            for callback in callbacks:
+                                callback(address, value)
+                        for callback in write_callbacks:
+                            callback(address, value)
+                        address += 2
+                    i += 2 * words
+                    count -= 2 * words
+                    sync_byte_count = 0
+                    state = ADDRESS_LOW if count == 0 else DATA_LOW
+                    continue
+
+            c = buffer[i]
+            i += 1
+            if state == ADDRESS_LOW:
+                address = c
+                state = ADDRESS_HIGH
+            elif state == ADDRESS_HIGH:
+                address += c * 256
+                if address != 0x5555:
+                    state = COUNT_LOW
+                else:
+                    state = WAIT_FOR_SYNC
+            elif state == COUNT_LOW:
+                count = c
+                state = COUNT_HIGH
+            elif state == COUNT_HIGH:
+                count += 256 * c
+                state = DATA_LOW
+            elif state == DATA_LOW:
+                data = c
+                count -= 1
+                state = DATA_HIGH
+            elif state == DATA_HIGH:
+                data += 256 * c
+                count -= 1
+                callbacks = address_callbacks.get(address)
+                if callbacks:
+                    for callback in callbacks:
+                        callback(address, data)
+                for callback in write_callbacks:
+                    callback(address, data)
+                address += 2
+                if count == 0:
+                    state = ADDRESS_LOW
+                else:
+                    state = DATA_LOW
+
+            if c == SYNC_BYTE:
+                sync_byte_count += 1
+            else:
+                sync_byte_count = 0
+
+            if sync_byte_count == 4:
+                state = ADDRESS_LOW
+                sync_byte_count = 0
+                for callback in self.frame_sync_callbacks:
+                    callback()
+
+        self.__state = state
+        self.__sync_byte_count = sync_byte_count
+        self.__address = address
+        self.__count = count
+        self.__data = data
 
 
 class StringBuffer:
@@ -75,7 +240,8 @@ class StringBuffer:
         self.callbacks = set()
         if callback:
             self.callbacks.add(callback)
-        parser.write_callbacks.add(lambda address, data: self.on_dcsbios_write(address, data))
+        parser.add_address_callback(address, length, self.on_dcsbios_write)
+        parser.add_address_callback(0xfffe, 1, self.on_dcsbios_write)
 
     def set_char(self, i, c):
         if self.buffer[i] != c:
@@ -105,7 +271,7 @@ class IntegerBuffer:
         self.callbacks = set()
         if callback:
             self.callbacks.add(callback)
-        parser.write_callbacks.add(lambda address, data: self.on_dcsbios_write(address, data))
+        parser.add_address_callback(address, 1, self.on_dcsbios_write)
 
     def on_dcsbios_write(self, address, data):
         if address == self.__address:
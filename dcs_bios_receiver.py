@@ -0,0 +1,92 @@
+import selectors
+import socket
+import struct
+
+from latency import tracer
+from log import get_logger
+
+log = get_logger("dcs")
+
+DEFAULT_CONNECTION = {
+    "multicast_group": "239.255.50.10",
+    "port": 5010,
+    "receive_buffer_size": 8192,
+    "poll_interval": 0.25,
+}
+
+
+class DcsBiosReceiver:
+    def __init__(self, parser, stop_event, multicast_group, port, receive_buffer_size=8192, poll_interval=0.25):
+        self.parser = parser
+        self.stop_event = stop_event
+        self.multicast_group = multicast_group
+        self.port = port
+        # How long the selector may block before stop_event is checked again
+        self.poll_interval = poll_interval
+        self.buffer = bytearray(receive_buffer_size)
+        self.view = memoryview(self.buffer)
+        self.recorder = None  # recording.Recorder, gets every datagram as received
+        self.datagrams = 0
+        self.bytes_received = 0
+        self.socket = None
+
+    @classmethod
+    def from_config(cls, parser, stop_event, config):
+        connection = dict(DEFAULT_CONNECTION)
+        connection.update(config.get("dcs_bios", {}))
+        return cls(parser, stop_event, connection["multicast_group"], connection["port"],
+                   connection["receive_buffer_size"], connection["poll_interval"])
+
+    def open(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("0.0.0.0", self.port))
+
+        # Join multicast group
+        mreq = struct.pack("4sl", socket.inet_aton(self.multicast_group), socket.INADDR_ANY)
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        s.setblocking(False)
+        self.socket = s
+        log.info("DCS reader started")
+        log.info("Listening on port %d", self.port)
+        log.info("Joined multicast group %s", self.multicast_group)
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def run(self):
+        if self.socket is None:
+            self.open()
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        try:
+            while not self.stop_event.is_set():
+                if not selector.select(self.poll_interval):
+                    continue
+                self.receive_pending()
+        finally:
+            selector.close()
+            self.close()
+
+    def receive_pending(self):
+        # Drain every queued datagram before going back to the selector
+        while True:
+            try:
+                nbytes, addr = self.socket.recvfrom_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.error("Socket error: %s", e)
+                return
+            if nbytes:
+                tracer.mark("dcs")
+                self.datagrams += 1
+                self.bytes_received += nbytes
+                if self.recorder:
+                    self.recorder.record_datagram(self.view[:nbytes])
+                try:
+                    self.parser.feed(self.view[:nbytes])
+                except Exception as e:
+                    log.exception("Unexpected error: %s", e)
@@ -1,3 +1,12 @@
+import ctypes
+
+from falcon_bms_reader import FlightData
+from ded_protocol import DEDFrameEncoder
+from latency import tracer
+from log import get_logger
+
+log = get_logger("ded")
+
 # Define a mapping for special control characters
 CONTROL_CHAR_MAPPING = {
     b'\x00': '',  # Null character
@@ -5,67 +14,120 @@ CONTROL_CHAR_MAPPING = {
     # Add more mappings as necessary
 }
 
+# Raw byte -> display text, built once from CONTROL_CHAR_MAPPING.
+# Used with str.translate on the latin-1 decoded bytes.
+TRANSLATION_TABLE = [
+    chr(b) if 32 <= b <= 126 else CONTROL_CHAR_MAPPING.get(bytes([b]), f'\\x{b:02x}')
+    for b in range(256)
+]
+
+class DisplayDecoder:
+    # Decodes a BMS text display (DED or PFL) straight from FlightData.
+    # The raw line and invert bytes of the last update are kept, so an
+    # unchanged display costs two short copies and a compare.
+    def __init__(self, lines_field="DEDLines", invert_field="Invert", rows=5, columns=26):
+        self.lines_offset = getattr(FlightData, lines_field).offset
+        self.invert_offset = getattr(FlightData, invert_field).offset
+        self.rows = rows
+        self.columns = columns
+        self.size = rows * columns
+        self.raw_lines = None
+        self.raw_invert = None
+        self.lines = [""] * rows
+        self.inverts = [0] * rows  # Bit n set when column n is drawn inverted
+
+    def update(self, flight_data):
+        # Returns True when the display changed since the last call
+        address = ctypes.addressof(flight_data)
+        raw_lines = ctypes.string_at(address + self.lines_offset, self.size)
+        raw_invert = ctypes.string_at(address + self.invert_offset, self.size)
+        if raw_lines == self.raw_lines and raw_invert == self.raw_invert:
+            return False
+
+        columns = self.columns
+        if raw_lines != self.raw_lines:
+            text = raw_lines.decode('latin-1')
+            self.lines = [text[i:i + columns].translate(TRANSLATION_TABLE) for i in range(0, self.size, columns)]
+        if raw_invert != self.raw_invert:
+            self.inverts = [
+                sum(1 << col for col, b in enumerate(raw_invert[i:i + columns]) if b not in (0, 0x20))
+                for i in range(0, self.size, columns)
+            ]
+        self.raw_lines = raw_lines
+        self.raw_invert = raw_invert
+        return True
+
+
 class DEDHandler:
-    def __init__(self, arduino_connection, mode, shared_data, middleware):
+    def __init__(self, arduino_connection, mode, state, middleware):
         self.arduino_connection = arduino_connection
         self.mode = mode
-        self.shared_data = shared_data
+        self.state = state
         self.last_message = None  # To store the last sent message
-        self.shared_data["DCS"]["DED_line1"] = ""
-        self.shared_data["DCS"]["DED_line2"] = ""
         self.middleware = middleware
+        self.ded_decoder = DisplayDecoder("DEDLines", "Invert")
+        self.encoder = None
+        if arduino_connection.protocol == "binary":
+            self.encoder = DEDFrameEncoder(arduino_connection.rows, arduino_connection.columns,
+                                           arduino_connection.keyframe_interval)
 
-    def process_data(self):
+    def process_output(self):
+        if self.arduino_connection.protocol == "dcs-bios":
+            return  # The board decodes DCS-BIOS itself, see dcs_bios_passthrough
         if self.mode == 'DCS':
             # Handle DCS data
-            ded_line1 = self.shared_data["DCS"]["DED_line1"]
-            ded_line2 = self.shared_data["DCS"]["DED_line2"]
-
-            # Ensure the lines are correctly stripped and combined with a delimiter
-            message = f"{ded_line1.strip()},{ded_line2.strip()}"
+            # Both lines from the same committed frame
+            dcs = self.state.snapshot("DCS").values
+            ded_lines = [dcs["DED_line1"], dcs["DED_line2"]]
+            stamp = dcs["DED_stamp"]
 
         elif self.mode == 'BMS':
             # Extract DED lines from shared data
-            flight_data = self.shared_data["BMS_flightdata"]
-            ded_lines = self.extract_ded_lines(flight_data)
-            ded_line1 = ded_lines[0] if len(ded_lines) > 0 else ""
-            ded_line2 = ded_lines[1] if len(ded_lines) > 1 else ""
+            flight_data = self.state.get("BMS", "flightdata")
+            if flight_data is None or not self.ded_decoder.update(flight_data):
+                # DED unchanged since last tick, only a due keyframe needs sending
+                if self.encoder is None or self.encoder.screen is None or not self.encoder.keyframe_due():
+                    return
+            ded_lines = self.ded_decoder.lines
+            stamp = self.state.get("BMS", "stamp")
+
+        if self.encoder is not None:
+            frame = self.encoder.encode(ded_lines)
+            if frame:
+                # Delta frames build on each other, so they must not be coalesced
+                self.arduino_connection.send_bytes(frame, stamp=stamp)
+            return
 
+        ded_line1 = ded_lines[0] if len(ded_lines) > 0 else ""
+        ded_line2 = ded_lines[1] if len(ded_lines) > 1 else ""
 
-            # Ensure the lines are correctly stripped and combined with a delimiter
-            message = f"{ded_line1.strip()},{ded_line2.strip()}"
+        # Ensure the lines are correctly stripped and combined with a delimiter
+        message = f"{ded_line1.strip()},{ded_line2.strip()}"
 
         # Send the message to the Arduino only if it has changed
         if message != self.last_message:
             self.last_message = message
-            print(f"Sending message to Arduino: '{message}'")
-            self.arduino_connection.send_data(message)
+            log.debug("Sending message to Arduino: '%s'", message)
+            self.arduino_connection.send_data(message, key="DED", stamp=stamp)
 
+    def process_input(self, input_line):
         # Handle button press (assume Arduino sends "Button pressed" when the button is pressed)
-        line = self.arduino_connection.read_data()
-        # if message is None return
-        if line is None:
-            return
+        line = input_line.line
+        stamp = tracer.stamp("serial", input_line.timestamp, input_line.device)
 
         if self.mode == 'DCS':
-            self.middleware.send_message_to_dcs(line)
+            self.middleware.send_message_to_dcs(line, stamp)
         elif self.mode == 'BMS':
-            self.middleware.bms_handler.send_key(line)
+            self.middleware.bms_handler.send_key(line, stamp)
 
 
 
 
     def decode_character(self, b):
         b_int = ord(b) if isinstance(b, bytes) else b
-        if 32 <= b_int <= 126:  # Printable ASCII range
-            return chr(b_int)
-        return CONTROL_CHAR_MAPPING.get(bytes([b_int]), f'\\x{b_int:02x}')  # Map control characters or show as hex
+        return TRANSLATION_TABLE[b_int]  # Printable ASCII, mapped control character or hex
 
     def extract_ded_lines(self, flight_data):
-        ded_lines = []
-        for i in range(5):  # There are 5 lines
-            line_bytes = getattr(flight_data, "DEDLines")[i]
-            line = ''.join(self.decode_character(b) for b in line_bytes).strip()  # Decode each line from bytes to string and strip any extra spaces
-            ded_lines.append(line)
-        return ded_lines
-
+        decoder = DisplayDecoder("DEDLines", "Invert")
+        decoder.update(flight_data)
+        return [line.strip() for line in decoder.lines]
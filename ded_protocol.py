@@ -0,0 +1,225 @@
+# Compact binary DED protocol between the middleware and the display Arduino.
+#
+# Frame:   SYNC1 SYNC2 LEN PAYLOAD[LEN] CHECKSUM
+#          CHECKSUM is LEN xor'ed with every payload byte.
+# Payload: one or more ops
+#          OP_FULL_REFRESH rows cols chars[rows * cols]
+#          OP_SET_CHARS    row col count chars[count]
+#
+# A full refresh (keyframe) is sent whenever the screen changed too much to be
+# worth diffing and at a fixed interval, so an Arduino that was reset or lost a
+# frame resyncs on its own. The reference decoder for the Arduino side is
+# ArduinoSRC/DEDTest/DedProtocol.h.
+import time
+
+SYNC1 = 0xA5
+SYNC2 = 0x5A
+OP_FULL_REFRESH = 0x01
+OP_SET_CHARS = 0x02
+MAX_PAYLOAD = 255
+# op + row + col + count
+SET_CHARS_OVERHEAD = 4
+
+
+def checksum(length, payload):
+    value = length
+    for b in payload:
+        value ^= b
+    return value
+
+
+def build_frame(payload):
+    payload = bytes(payload)
+    return bytes((SYNC1, SYNC2, len(payload))) + payload + bytes((checksum(len(payload), payload),))
+
+
+class DEDFrameEncoder:
+    def __init__(self, rows, columns, keyframe_interval=2.0):
+        if rows * columns + 3 > MAX_PAYLOAD:
+            raise ValueError("Screen too large for a single keyframe")
+        self.rows = rows
+        self.columns = columns
+        self.keyframe_interval = keyframe_interval
+        self.screen = None
+        self.last_keyframe = 0.0
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes_sent = 0
+
+    def pack_lines(self, lines):
+        screen = []
+        for row in range(self.rows):
+            line = lines[row] if row < len(lines) else ""
+            line = line.encode('latin-1', errors='replace')[:self.columns]
+            screen.append(line.ljust(self.columns, b' '))
+        return screen
+
+    def keyframe_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.screen is None or now - self.last_keyframe >= self.keyframe_interval
+
+    def encode(self, lines, now=None):
+        # Returns the bytes to send, or b'' if nothing needs to go out
+        now = time.monotonic() if now is None else now
+        screen = self.pack_lines(lines)
+        if self.keyframe_due(now):
+            return self._keyframe(screen, now)
+
+        ops = []
+        size = 0
+        for row in range(self.rows):
+            for col, chars in self._changed_runs(self.screen[row], screen[row]):
+                ops.append(bytes((OP_SET_CHARS, row, col, len(chars))) + chars)
+                size += SET_CHARS_OVERHEAD + len(chars)
+        if not ops:
+            return b''
+        if size >= self.rows * self.columns + 3:
+            return self._keyframe(screen, now)
+
+        self.screen = screen
+        frames = []
+        payload = b''
+        for op in ops:
+            if len(payload) + len(op) > MAX_PAYLOAD:
+                frames.append(build_frame(payload))
+                payload = b''
+            payload += op
+        frames.append(build_frame(payload))
+        return self._count(b''.join(frames), len(frames))
+
+    def _keyframe(self, screen, now):
+        self.screen = screen
+        self.last_keyframe = now
+        self.keyframes += 1
+        payload = bytes((OP_FULL_REFRESH, self.rows, self.columns)) + b''.join(screen)
+        return self._count(build_frame(payload), 1)
+
+    def _count(self, data, frames):
+        self.frames += frames
+        self.bytes_sent += len(data)
+        return data
+
+    def _changed_runs(self, old, new):
+        # Yields (col, chars) runs. Runs separated by fewer unchanged chars than
+        # an op header are merged, because resending them is cheaper.
+        start = None
+        last = None
+        for col in range(self.columns):
+            if old[col] != new[col]:
+                if start is None:
+                    start = col
+                elif col - last - 1 >= SET_CHARS_OVERHEAD:
+                    yield start, new[start:last + 1]
+                    start = col
+                last = col
+        if start is not None:
+            yield start, new[start:last + 1]
+
+
+# DEDFrameDecoder states, as in DedProtocol.h
+WAIT_SYNC1 = 0
+WAIT_SYNC2 = 1
+READ_LENGTH = 2
+READ_PAYLOAD = 3
+READ_CHECKSUM = 4
+
+
+class DEDFrameDecoder:
+    # Python twin of DedProtocol.h, used to check encoder output. It runs the
+    # same byte state machine, so it resyncs the same way: a frame with a bad
+    # checksum or payload is consumed whole, then the next sync is awaited.
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.screen = [bytearray(b' ' * columns) for _ in range(rows)]
+        self.synced = False
+        self.frames = 0
+        self.errors = 0
+        self._state = WAIT_SYNC1
+        self._length = 0
+        self._checksum = 0
+        self._payload = bytearray()
+
+    def lines(self):
+        return [bytes(row).decode('latin-1') for row in self.screen]
+
+    def feed(self, data):
+        for b in data:
+            state = self._state
+            if state == WAIT_SYNC1:
+                if b == SYNC1:
+                    self._state = WAIT_SYNC2
+            elif state == WAIT_SYNC2:
+                if b == SYNC2:
+                    self._state = READ_LENGTH
+                elif b != SYNC1:
+                    self._state = WAIT_SYNC1
+            elif state == READ_LENGTH:
+                self._length = b
+                self._checksum = b
+                self._payload = bytearray()
+                self._state = READ_PAYLOAD if b else READ_CHECKSUM
+            elif state == READ_PAYLOAD:
+                self._payload.append(b)
+                self._checksum ^= b
+                if len(self._payload) == self._length:
+                    self._state = READ_CHECKSUM
+            else:
+                self._state = WAIT_SYNC1
+                if b == self._checksum and self._apply(bytes(self._payload)):
+                    self.frames += 1
+                else:
+                    self.errors += 1
+
+    def _apply(self, payload):
+        i = 0
+        while i < len(payload):
+            op = payload[i]
+            if op == OP_FULL_REFRESH and i + 3 <= len(payload):
+                rows, columns = payload[i + 1], payload[i + 2]
+                chars = payload[i + 3:i + 3 + rows * columns]
+                if rows != self.rows or columns != self.columns or len(chars) != rows * columns:
+                    return False
+                for row in range(rows):
+                    self.screen[row][:] = chars[row * columns:(row + 1) * columns]
+                self.synced = True
+                i += 3 + rows * columns
+            elif op == OP_SET_CHARS and i + 4 <= len(payload):
+                row, col, count = payload[i + 1], payload[i + 2], payload[i + 3]
+                chars = payload[i + 4:i + 4 + count]
+                if row >= self.rows or col + count > self.columns or len(chars) != count:
+                    return False
+                self.screen[row][col:col + count] = chars
+                i += 4 + count
+            else:
+                return False
+        return True
+
+
+def round_trip_demo(pages=1000, rows=5, columns=26):
+    # Feeds random DED-like edits through encoder and decoder, checks that the
+    # decoded screen always matches, and compares bytes against the text protocol.
+    import random
+    rng = random.Random(0)
+    encoder = DEDFrameEncoder(rows, columns)
+    decoder = DEDFrameDecoder(rows, columns)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .:/*"
+    lines = ["".join(rng.choice(alphabet) for _ in range(columns)) for _ in range(rows)]
+    text_bytes = 0
+    now = 0.0
+    for _ in range(pages):
+        now += 0.05
+        row = rng.randrange(rows)
+        line = list(lines[row])
+        for _ in range(rng.randint(1, 3)):
+            line[rng.randrange(columns)] = rng.choice(alphabet)
+        lines[row] = "".join(line)
+        decoder.feed(encoder.encode(lines, now))
+        assert decoder.lines() == [bytes(r).decode('latin-1') for r in encoder.screen]
+        text_bytes += len(",".join(line.strip() for line in lines)) + 1
+    print(f"{pages} pages: binary {encoder.bytes_sent} bytes ({encoder.keyframes} keyframes), "
+          f"text {text_bytes} bytes, saved {100.0 * (1 - encoder.bytes_sent / text_bytes):.1f}%")
+
+
+if __name__ == "__main__":
+    round_trip_demo()
@@ -19,6 +19,11 @@
 import ctypes
 import struct
 import mmap
+import os
+
+from log import get_logger
+
+log = get_logger("bms")
 
 class FlightData(ctypes.Structure):
     name = "FalconSharedMemoryArea"
@@ -91,11 +96,11 @@ class FlightData(ctypes.Structure):
         ("RwrObjectCount", ctypes.c_int),
         ("RWRsymbol", ctypes.c_int * 40),
         ("bearing", ctypes.c_float * 40),
-        ("missileActivity", ctypes.c_ulong * 40),
-        ("missileLaunch", ctypes.c_ulong * 40),
-        ("selected", ctypes.c_ulong * 40),
+        ("missileActivity", ctypes.c_uint32 * 40),
+        ("missileLaunch", ctypes.c_uint32 * 40),
+        ("selected", ctypes.c_uint32 * 40),
         ("lethality", ctypes.c_float * 40),
-        ("newDetection", ctypes.c_ulong * 40),
+        ("newDetection", ctypes.c_uint32 * 40),
         ("fwd", ctypes.c_float),
         ("aft", ctypes.c_float),
         ("total", ctypes.c_float),
@@ -246,9 +251,28 @@ class Strings():
         "ThrTerrdatadir"
     ]
 
+    header = struct.Struct("<3I")
+    entry = struct.Struct("<2I")
+
     def add(self, id, value):
         setattr(self, id, value)
 
+def parse_strings(buffer):
+    # Header is version, string count, data size, followed by one
+    # (id, length) entry per string with length + 1 bytes of NUL-terminated data.
+    version_num, num_strings, data_size = Strings.header.unpack_from(buffer, 0)
+    offset = Strings.header.size
+    entry_size = Strings.entry.size
+    unpack_entry = Strings.entry.unpack_from
+    instance = Strings()
+    for id in Strings.id:
+        str_id, str_length = unpack_entry(buffer, offset)
+        offset += entry_size
+        str_data = bytes(buffer[offset:offset + str_length + 1]).decode('utf-8').rstrip('\x00')
+        offset += str_length + 1
+        instance.add(id, str_data)
+    return instance
+
 def read_shared_memory(structure):
     try:
         sm = mmap.mmap(-1, ctypes.sizeof(structure), structure.name, access=mmap.ACCESS_READ)
@@ -263,21 +287,205 @@ def read_shared_memory(structure):
 def read_shared_memory_strings():
     try:
         sm = mmap.mmap(-1, Strings.area_size_max, Strings.name, access=mmap.ACCESS_READ)
-        version_num = struct.unpack('I', sm.read(4))[0]
-        num_strings = struct.unpack('I', sm.read(4))[0]
-        data_size = struct.unpack('I', sm.read(4))[0]
-        instance = Strings()
-        for id in Strings.id:
-            str_id = struct.unpack('I', sm.read(4))[0]
-            str_length = struct.unpack('I', sm.read(4))[0]
-            str_data = sm.read(str_length + 1).decode('utf-8').rstrip('\x00')
-            instance.add(id, str_data)
+        instance = parse_strings(sm)
         sm.close()
         return instance
     except Exception as e:
         print("Error reading shared memory '{}': {}".format(Strings.name, e))
         return None
 
+FILE_MAP_READ = 0x0004
+
+class TagnameBackend():
+    # Named shared memory as created by BMS on Windows. mmap with a tagname
+    # creates a zeroed mapping of its own when the name does not exist yet,
+    # so only mappings BMS already created are opened.
+    def exists(self, name):
+        kernel32 = ctypes.windll.kernel32
+        kernel32.OpenFileMappingW.restype = ctypes.c_void_p
+        kernel32.OpenFileMappingW.argtypes = (ctypes.c_uint32, ctypes.c_int, ctypes.c_wchar_p)
+        kernel32.CloseHandle.argtypes = (ctypes.c_void_p,)
+        handle = kernel32.OpenFileMappingW(FILE_MAP_READ, False, name)
+        if not handle:
+            return False
+        kernel32.CloseHandle(handle)
+        return True
+
+    def open(self, name, size):
+        if not self.exists(name):
+            raise FileNotFoundError("{} does not exist, is BMS running?".format(name))
+        # ACCESS_COPY gives a writable (copy-on-write) view so ctypes from_buffer
+        # works, while nothing is ever written back into BMS's own memory.
+        return mmap.mmap(-1, size, name, access=mmap.ACCESS_COPY)
+
+    def __repr__(self):
+        return "TagnameBackend()"
+
+class FileBackend():
+    # Regular files named after the BMS areas, e.g. /dev/shm/FalconSharedMemoryArea.
+    # Used for Wine/Proton bridges, recordings and running without BMS.
+    def __init__(self, directory="/dev/shm"):
+        self.directory = directory
+
+    def open(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                raise ValueError("{} is empty".format(path))
+            return mmap.mmap(f.fileno(), min(size, file_size), access=mmap.ACCESS_COPY)
+
+    def __repr__(self):
+        return "FileBackend({!r})".format(self.directory)
+
+def default_backend():
+    if os.name == "nt":
+        return TagnameBackend()
+    return FileBackend()
+
+def backend_from_config(config):
+    bms_config = config.get("bms", {})
+    backend = bms_config.get("shared_memory_backend")
+    if backend == "tagname":
+        return TagnameBackend()
+    if backend == "file":
+        return FileBackend(bms_config.get("shared_memory_path", "/dev/shm"))
+    return default_backend()
+
+class FieldWatch():
+    # One watched field of a shared memory structure. Offset, size and decoder
+    # are worked out once from the _fields_ layout, so a poll is a slice and a
+    # compare of just this field's bytes.
+    def __init__(self, structure, field):
+        ctype = dict(structure._fields_)[field]
+        descriptor = getattr(structure, field)
+        self.structure = structure
+        self.field = field
+        self.offset = descriptor.offset
+        self.end = descriptor.offset + descriptor.size
+        self.raw = None
+        self.callbacks = []
+        if issubclass(ctype, ctypes.Array):
+            self.decode = ctype.from_buffer_copy
+        else:
+            unpack_from = struct.Struct(ctype._type_).unpack_from
+            self.decode = lambda raw: unpack_from(raw)[0]
+
+    def poll(self, buffer):
+        raw = buffer[self.offset:self.end]
+        if raw != self.raw:
+            self.raw = raw
+            value = self.decode(raw)
+            for callback in self.callbacks:
+                callback(value)
+
+class SharedMemoryReader():
+    # Keeps every shared memory area mapped for the lifetime of the reader.
+    # view() returns a live ctypes structure over the mapping (no copy),
+    # snapshot() returns a private copy for when a consistent value matters.
+    def __init__(self, backend=None):
+        self.backend = backend or default_backend()
+        self.areas = {}
+        self.views = {}
+        self.watches = {}
+        self.strings_stamp = None
+        self.strings_cache = None
+
+    def area(self, name, size):
+        sm = self.areas.get(name)
+        if sm is None:
+            try:
+                sm = self.backend.open(name, size)
+            except Exception as e:
+                # Repeats every tick while BMS is not running, the log rate limits it
+                log.error("Error opening shared memory '%s': %s", name, str(e))
+                return None
+            self.areas[name] = sm
+        return sm
+
+    def view(self, structure):
+        view = self.views.get(structure)
+        if view is None:
+            sm = self.area(structure.name, ctypes.sizeof(structure))
+            if sm is None:
+                return None
+            if len(sm) < ctypes.sizeof(structure):
+                # e.g. a dump written with a different structure layout
+                log.error("Shared memory '%s' has %d bytes, %s needs %d",
+                          structure.name, len(sm), structure.__name__, ctypes.sizeof(structure))
+                return None
+            view = structure.from_buffer(sm)
+            self.views[structure] = view
+        return view
+
+    def buffer(self, structure, size=None):
+        sm = self.area(structure.name, size or ctypes.sizeof(structure))
+        if sm is None:
+            return None
+        return memoryview(sm)
+
+    def snapshot(self, structure):
+        view = self.view(structure)
+        if view is None:
+            return None
+        return structure.from_buffer_copy(view)
+
+    def subscribe(self, structure, field, callback):
+        # callback(value) runs from dispatch_changes() whenever the field changes
+        fields = self.watches.setdefault(structure, {})
+        watch = fields.get(field)
+        if watch is None:
+            watch = FieldWatch(structure, field)
+            fields[field] = watch
+        watch.callbacks.append(callback)
+        return watch
+
+    def unsubscribe(self, structure, field, callback):
+        fields = self.watches.get(structure, {})
+        watch = fields.get(field)
+        if watch is not None and callback in watch.callbacks:
+            watch.callbacks.remove(callback)
+            if not watch.callbacks:
+                del fields[field]
+
+    def dispatch_changes(self):
+        for structure, fields in self.watches.items():
+            if not fields:
+                continue
+            sm = self.area(structure.name, ctypes.sizeof(structure))
+            if sm is None:
+                continue
+            for watch in fields.values():
+                watch.poll(sm)
+
+    def strings(self):
+        # The string area only changes when BMS bumps StringAreaTime (and
+        # usually StringAreaSize), so unchanged ticks return the cached instance.
+        flightdata2 = self.view(FlightData2)
+        stamp = None
+        if flightdata2 is not None:
+            stamp = (flightdata2.StringAreaTime, flightdata2.StringAreaSize)
+            if stamp == self.strings_stamp and self.strings_cache is not None:
+                return self.strings_cache
+        sm = self.area(Strings.name, Strings.area_size_max)
+        if sm is None:
+            return self.strings_cache
+        try:
+            self.strings_cache = parse_strings(sm)
+            self.strings_stamp = stamp
+        except Exception as e:
+            log.error("Error reading shared memory '%s': %s", Strings.name, str(e))
+        return self.strings_cache
+
+    def close(self):
+        self.views.clear()
+        for name, sm in self.areas.items():
+            try:
+                sm.close()
+            except BufferError:
+                print("Shared memory '{}' is still referenced, leaving it mapped".format(name))
+        self.areas.clear()
+
 def examples():
     flightdata = read_shared_memory(FlightData)
     flightdata2 = read_shared_memory(FlightData2)
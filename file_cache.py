@@ -0,0 +1,46 @@
+import hashlib
+import os
+import pickle
+
+
+def load_cached(path, build, version, key=None, cache_path=None, description="cache"):
+    # Returns build(content) for the file at path, pickled next to it (or at
+    # cache_path). Warm starts only stat the file and unpickle the cache. If
+    # size or mtime changed the content hash decides, so touching the file is
+    # cheap too. version and key (anything else the result depends on, e.g. a
+    # lookup table's fingerprint) must match as well or the cache is rebuilt.
+    cache_path = cache_path or path + ".cache"
+    stat = os.stat(path)
+    cached = None
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") != version or cached.get("key") != key:
+            cached = None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        cached = None
+
+    if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+        return cached["value"]
+
+    with open(path, "rb") as f:
+        content = f.read()
+    fingerprint = hashlib.sha1(content).hexdigest()
+    if cached and cached["fingerprint"] == fingerprint:
+        value = cached["value"]
+    else:
+        value = build(content)
+
+    try:
+        with open(cache_path, "wb") as f:
+            pickle.dump({
+                "version": version,
+                "key": key,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "fingerprint": fingerprint,
+                "value": value,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write {description} '{cache_path}': {e}")
+    return value
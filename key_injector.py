@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+
+from latency import tracer
+from log import get_logger
+
+log = get_logger("keys")
+
+# BMS keyfile modifier codes are a bitmask: 1 = shift, 2 = ctrl, 4 = alt
+MODIFIER_PREFIXES = (
+    '',
+    'shift+',
+    'ctrl+',
+    'ctrl+shift+',
+    'alt+',
+    'shift+alt+',
+    'ctrl+alt+',
+    'ctrl+shift+alt+',
+)
+
+
+def build_chord(key, modifier):
+    return MODIFIER_PREFIXES[int(modifier)] + key
+
+
+class KeyboardBackend:
+    # Real key presses through the keyboard package (Windows)
+    def __init__(self):
+        import keyboard
+        self.press_and_release = keyboard.press_and_release
+
+    def send(self, chord):
+        self.press_and_release(chord)
+
+
+class RecordingBackend:
+    # Records chords instead of pressing them, for running without BMS
+    def __init__(self):
+        self.events = []
+
+    def send(self, chord):
+        self.events.append((chord, time.monotonic()))
+
+
+def injector_backend_from_config(config):
+    # "keys": {"injector_backend": "recording"} runs without pressing any keys
+    backend = config.get("keys", {}).get("injector_backend", "keyboard")
+    if backend == "recording":
+        return RecordingBackend()
+    if backend == "keyboard":
+        return KeyboardBackend()
+    raise ValueError(f"Unknown key injector backend '{backend}'")
+
+
+class KeyInjector:
+    # Presses chords on a worker thread so callers never wait for the
+    # key_interval pacing BMS needs between key presses.
+    def __init__(self, backend=None, max_pending=32, key_interval=0.01):
+        self.backend = backend or KeyboardBackend()
+        self.key_interval = key_interval
+        self.counters = {
+            "injected": 0,
+            "dropped": 0,
+            "failed": 0,
+        }
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="key-injector", daemon=True)
+        self._thread.start()
+
+    def inject(self, chord, stamp=None):
+        # Returns False when the queue is full and the chord was dropped
+        try:
+            self._queue.put_nowait((chord, time.monotonic(), stamp))
+        except queue.Full:
+            self.counters["dropped"] += 1
+            return False
+        return True
+
+    def wait_idle(self):
+        self._queue.join()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["pending"] = self._queue.qsize()
+        injected = stats["injected"]
+        stats["avg_latency_ms"] = self.total_latency / injected * 1000.0 if injected else 0.0
+        stats["max_latency_ms"] = self.max_latency * 1000.0
+        return stats
+
+    def stop(self, timeout=1.0):
+        self._queue.put((None, None, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            chord, queued_at, stamp = self._queue.get()
+            try:
+                if chord is None:
+                    return
+                latency = time.monotonic() - queued_at
+                try:
+                    self.backend.send(chord)
+                except Exception as e:
+                    self.counters["failed"] += 1
+                    log.error("Error sending key '%s': %s", chord, e)
+                    continue
+                tracer.record(stamp, "key")
+                self.counters["injected"] += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                if self.key_interval:
+                    time.sleep(self.key_interval)  # Delay to simulate realistic key press timing
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,72 @@
+import hashlib
+
+from file_cache import load_cached
+
+CACHE_VERSION = 3
+
+# Scan code of keyfile entries that have no key assigned
+NO_KEY = "0xffffffff"
+
+
+class KeyfileIndex:
+    # bindings holds plain (scan code, modifier, key name) tuples rather than
+    # objects, which keeps unpickling the cache fast. The key name is None
+    # when hex_to_key has no entry for the scan code.
+    def __init__(self, bindings, unresolved):
+        self.bindings = bindings  # callback -> [(scan code, modifier, key name), ...] in keyfile order
+        self.unresolved = unresolved  # scan code -> [callback, ...]
+
+    def primary(self, callback):
+        # First binding of a callback that maps to a known key
+        for binding in self.bindings.get(callback, ()):
+            if binding[2]:
+                return binding
+        return None
+
+    def key_mappings(self):
+        # callback -> (key name, modifier) for every callback with a usable binding
+        mappings = {}
+        for callback in self.bindings:
+            binding = self.primary(callback)
+            if binding:
+                mappings[callback] = (binding[2], binding[1])
+        return mappings
+
+
+def compile_keyfile(lines, hex_to_key):
+    bindings = {}
+    unresolved = {}
+    for line in lines:
+        if line.startswith("#") or " -1 " in line:
+            continue
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        callback, scan_code, modifier = parts[0], parts[3].lower(), parts[4]
+        key = hex_to_key.get(scan_code)
+        bindings.setdefault(callback, []).append((scan_code, modifier, key))
+        if key is None and scan_code != NO_KEY:
+            unresolved.setdefault(scan_code, []).append(callback)
+    return KeyfileIndex(bindings, unresolved)
+
+
+def _table_fingerprint(hex_to_key):
+    # The resolved key names depend on the scan code table too
+    return hashlib.sha1(repr(sorted(hex_to_key.items())).encode()).hexdigest()
+
+
+def load_keyfile_index(path, hex_to_key, cache_path=None):
+    bindings, unresolved = load_cached(
+        path,
+        lambda content: _compile(content, hex_to_key),
+        CACHE_VERSION,
+        key=_table_fingerprint(hex_to_key),
+        cache_path=cache_path,
+        description="keyfile cache",
+    )
+    return KeyfileIndex(bindings, unresolved)
+
+
+def _compile(content, hex_to_key):
+    index = compile_keyfile(content.decode("utf-8", errors="replace").splitlines(), hex_to_key)
+    return index.bindings, index.unresolved
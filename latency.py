@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import namedtuple
+
+# Where and when a piece of data entered the middleware: source is "dcs"
+# (UDP datagram received), "bms" (shared memory read) or "serial" (line from
+# an Arduino). Stamps travel with the data and are recorded at the sink.
+Stamp = namedtuple("Stamp", ["source", "time", "device"])
+
+
+class LatencyHistogram:
+    # HDR style histogram of microsecond values: exact below sub_buckets,
+    # above that every power of two is split into sub_buckets / 2 linear
+    # buckets, so any value is off by at most 2 / sub_buckets (about 3% with
+    # the default). Recording is a bit_length and a list increment.
+    def __init__(self, sub_bucket_bits=6, max_exponent=40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.half = self.sub_buckets >> 1
+        self.counts = [0] * (self.sub_buckets + max_exponent * self.half)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value):
+        if value < self.sub_buckets:
+            return value
+        exponent = value.bit_length() - self.sub_bucket_bits
+        return self.sub_buckets + (exponent - 1) * self.half + (value >> exponent) - self.half
+
+    def value_at(self, index):
+        # Highest value that lands in bucket index
+        if index < self.sub_buckets:
+            return index
+        exponent, offset = divmod(index - self.sub_buckets, self.half)
+        exponent += 1
+        return ((offset + self.half + 1) << exponent) - 1
+
+    def record(self, value):
+        index = self.index(value)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.value_at(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class LatencyTracer:
+    # One histogram per path ("dcs>serial", "serial>key", ...) and device.
+    # Disabled tracers hand out no stamps, so every record() call returns at
+    # once and the hot paths only pay for a None check.
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.current = {}  # source -> Stamp of the data being processed right now
+        self.last = None  # Most recent stamp of any source
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._since = time.monotonic()
+
+    def mark(self, source, now=None, device=None):
+        # Called where data enters; returns the stamp to carry along
+        if not self.enabled:
+            return None
+        stamp = Stamp(source, time.monotonic() if now is None else now, device)
+        self.current[source] = stamp
+        self.last = stamp
+        return stamp
+
+    def stamp(self, source, timestamp, device=None):
+        # Stamp for data that already carries its own receive time
+        if not self.enabled:
+            return None
+        return Stamp(source, timestamp, device)
+
+    def origin(self, source):
+        return self.current.get(source) if self.enabled else None
+
+    def record(self, stamp, sink, device=None, now=None):
+        if stamp is None:
+            return
+        now = time.monotonic() if now is None else now
+        key = (stamp.source, sink, device or stamp.device)
+        with self._lock:
+            histogram = self._paths.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._paths[key] = histogram
+                self.histograms[(stamp.source + ">" + sink, key[2])] = histogram
+            histogram.record(max(0, int((now - stamp.time) * 1e6)))
+
+    def report(self):
+        with self._lock:
+            return {
+                path: {
+                    "count": histogram.count,
+                    "mean_ms": histogram.mean() / 1000.0,
+                    "p50_ms": histogram.percentile(50) / 1000.0,
+                    "p90_ms": histogram.percentile(90) / 1000.0,
+                    "p99_ms": histogram.percentile(99) / 1000.0,
+                    "max_ms": histogram.max / 1000.0,
+                }
+                for path, histogram in sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+                if histogram.count
+            }
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self._since = time.monotonic()
+
+    def print_report(self, reset=True):
+        report = self.report()
+        print(f"Latency over {time.monotonic() - self._since:.1f}s:")
+        if not report:
+            print("  nothing recorded")
+        for (path, device), stats in report.items():
+            print(f"  {path} {device or ''}: {stats['count']} samples, p50 {stats['p50_ms']:.2f}ms, "
+                  f"p90 {stats['p90_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms, max {stats['max_ms']:.2f}ms")
+        if reset:
+            self.reset()
+
+
+# Shared by every module that stamps or records, enabled from config.json
+tracer = LatencyTracer()
@@ -0,0 +1,192 @@
+import copy
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Subsystem loggers live under "middleware": middleware.dcs, middleware.bms,
+# middleware.serial, middleware.ded, middleware.keys, middleware.input and
+# middleware.scheduler. Until setup_logging() runs they behave like plain
+# stdlib loggers, so modules used on their own still report warnings.
+ROOT = "middleware"
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def get_logger(subsystem):
+    return logging.getLogger(ROOT + "." + subsystem)
+
+
+_plain = logging.Formatter()
+
+
+def prepare(record):
+    # What QueueHandler.prepare does, without needing a handler: message and
+    # traceback become text, so a record kept for later holds no arguments,
+    # exceptions or frames (and through those, no mapped ctypes views)
+    record = copy.copy(record)
+    message = record.getMessage()
+    if record.exc_info:
+        message += "\n" + _plain.formatException(record.exc_info)
+    if record.stack_info:
+        message += "\n" + _plain.formatStack(record.stack_info)
+    record.msg = message
+    record.args = None
+    record.exc_info = None
+    record.exc_text = None
+    record.stack_info = None
+    return record
+
+
+class RateLimitFilter(logging.Filter):
+    # Lets through at most `burst` records per message per `interval`
+    # seconds. A message is its logger, level and unformatted template, so
+    # "Socket error: %s" counts as one message whatever the error was. The
+    # number suppressed is reported once the window is over, either on the
+    # next record of that message or by flush().
+    def __init__(self, interval=1.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}  # key -> [window start, records seen, last suppressed record]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        with self._lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None and window[1] > self.burst:
+                    record.suppressed = (window[1] - self.burst, now - window[0])
+                self.windows[key] = [now, 1, None]
+                return True
+            window[1] += 1
+            if window[1] <= self.burst:
+                return True
+            window[2] = prepare(record)
+            return False
+
+    def flush(self, force=False):
+        # Summaries of windows that ended with records still suppressed;
+        # force ends every window, e.g. on shutdown
+        now = time.time()
+        summaries = []
+        with self._lock:
+            for key, window in list(self.windows.items()):
+                if not force and now - window[0] < self.interval:
+                    continue
+                del self.windows[key]
+                if window[1] > self.burst:
+                    record = window[2]
+                    record.suppressed = (window[1] - self.burst, now - window[0])
+                    summaries.append(record)
+        return summaries
+
+
+class SummaryFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            count, window = suppressed
+            message += f" (x{count} more in last {window:.1f} s)"
+        return message
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    # Hands prepared records to the writer thread, so the calling thread never
+    # touches the console. A full queue drops the record instead of blocking a
+    # hot path.
+    def __init__(self, records):
+        super().__init__(records)
+        self.records = records
+        self.dropped = 0
+
+    def prepare(self, record):
+        return prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_STOP = object()
+
+
+class LogWriter:
+    # Background thread that formats and writes queued records, and emits
+    # rate limit summaries while things are quiet.
+    def __init__(self, handler, limiter, max_pending=4096):
+        self.handler = handler
+        self.limiter = limiter
+        self.records = queue.Queue(maxsize=max_pending)
+        self.queueing_handler = QueueingHandler(self.records)
+        self.queueing_handler.addFilter(limiter)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.records.get(timeout=self.limiter.interval)
+            except queue.Empty:
+                record = None
+            for summary in self.limiter.flush(record is _STOP):
+                self.handler.handle(summary)
+            if record is _STOP:
+                return
+            if record is not None:
+                self.handler.handle(record)
+
+    def stop(self, timeout=1.0):
+        # Everything queued before the stop marker is still written
+        try:
+            self.records.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self.handler.flush()
+
+
+_writer = None
+
+
+def setup_logging(config=None):
+    # config is the "logging" section of config.json:
+    #   {"level": "INFO", "levels": {"serial": "DEBUG"}, "file": "",
+    #    "rate_limit_interval": 1.0, "rate_limit_burst": 5}
+    global _writer
+    config = config or {}
+    shutdown_logging()
+    if config.get("file"):
+        handler = logging.FileHandler(config["file"], encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(SummaryFormatter(config.get("format", DEFAULT_FORMAT)))
+    limiter = RateLimitFilter(config.get("rate_limit_interval", 1.0), config.get("rate_limit_burst", 5))
+    _writer = LogWriter(handler, limiter, config.get("max_pending", 4096))
+
+    root = logging.getLogger(ROOT)
+    root.handlers = [_writer.queueing_handler]
+    root.propagate = False
+    root.setLevel(config.get("level", "INFO"))
+    for subsystem, level in config.get("levels", {}).items():
+        get_logger(subsystem).setLevel(level)
+    return _writer
+
+
+def shutdown_logging():
+    # Writes out everything still queued
+    global _writer
+    if _writer is None:
+        return
+    logging.getLogger(ROOT).handlers = []
+    _writer.stop()
+    if _writer.queueing_handler.dropped:
+        print(f"Log queue overflowed, {_writer.queueing_handler.dropped} records dropped")
+    _writer = None
@@ -0,0 +1,107 @@
+import json
+import time
+
+# Action kinds returned by MappingEngine.lookup
+ACTION_NONE = 0  # Mapped on purpose to nothing, e.g. a button release
+ACTION_KEY = 1  # (ACTION_KEY, chord or callback)
+ACTION_AXIS = 2  # (ACTION_AXIS, control, raw value)
+
+NO_ACTION = (ACTION_NONE,)
+
+# Mapping entry types, see mappings.json:
+#   {"control": "ICP_BTN_6", "type": "button", "press": "SimICPStpt", "release": ""}
+#   {"control": "ICP_DATA_UP_DN_SW", "type": "toggle", "positions": {"0": "SimICPDEDDOWN", "2": "SimICPDEDUP"}}
+#   {"control": "EXAMPLE_KNB", "type": "rotary", "inc": "SimStepComm1VolumeUp", "dec": "SimStepComm1VolumeDown"}
+#   {"control": "ICP_HUD_BRT_KNB", "type": "axis"}
+ENTRY_TYPES = ("button", "toggle", "rotary", "axis")
+
+
+class MappingEngine:
+    # Compiles the declarative DCS-BIOS -> BMS table into
+    # control name -> (is_axis, is_rotary, value -> action). A line is split
+    # once and resolved with two dict lookups, however many controls there are.
+    def __init__(self, entries, chords=None):
+        self.index = {}
+        self.unresolved = []  # BMS callbacks with no key binding
+        for entry in entries:
+            self.add(entry, chords)
+
+    @classmethod
+    def from_file(cls, path, chords=None):
+        with open(path, 'r') as f:
+            return cls(json.load(f), chords)
+
+    def _action(self, callback, chords):
+        if not callback:
+            return NO_ACTION
+        if chords is None:
+            return (ACTION_KEY, callback)
+        chord = chords.get(callback)
+        if chord is None:
+            self.unresolved.append(callback)
+            return NO_ACTION
+        return (ACTION_KEY, chord)
+
+    def add(self, entry, chords=None):
+        control = entry["control"]
+        kind = entry.get("type", "button")
+        if kind not in ENTRY_TYPES:
+            raise ValueError(f"Unknown mapping type '{kind}' for {control}")
+        if kind == "axis":
+            self.index[control] = (True, False, None)
+            return
+        if kind == "button":
+            table = {"1": self._action(entry.get("press"), chords), "0": self._action(entry.get("release"), chords)}
+        elif kind == "toggle":
+            table = {str(value): self._action(callback, chords) for value, callback in entry["positions"].items()}
+        else:
+            table = {"INC": self._action(entry.get("inc"), chords), "DEC": self._action(entry.get("dec"), chords)}
+        self.index[control] = (False, kind == "rotary", table)
+
+    def lookup(self, line):
+        # Returns an action tuple, or None if the line is not mapped at all
+        control, _, value = line.partition(" ")
+        handler = self.index.get(control)
+        if handler is None:
+            return None
+        is_axis, is_rotary, table = handler
+        if is_axis:
+            return (ACTION_AXIS, control, int(value)) if value.isdigit() else None
+        action = table.get(value)
+        if action is None and is_rotary and value[:1] in ("+", "-"):
+            # Variable step encoders send "+3200" / "-3200" instead of INC/DEC
+            action = table["INC" if value[0] == "+" else "DEC"]
+        return action
+
+    def __len__(self):
+        return len(self.index)
+
+
+def benchmark_dispatch(controls=2000, lines=200000):
+    # Per-line dispatch cost with a table the size of a full pit
+    entries = []
+    for i in range(controls):
+        kind = ENTRY_TYPES[i % len(ENTRY_TYPES)]
+        entry = {"control": f"CONTROL_{i}", "type": kind}
+        if kind == "button":
+            entry.update(press=f"SimPress{i}", release="")
+        elif kind == "toggle":
+            entry["positions"] = {str(p): f"SimPos{i}_{p}" for p in range(3)}
+        elif kind == "rotary":
+            entry.update(inc=f"SimInc{i}", dec=f"SimDec{i}")
+        entries.append(entry)
+    engine = MappingEngine(entries)
+    values = {"button": "1", "toggle": "2", "rotary": "INC", "axis": "32768"}
+    sample = [f"CONTROL_{i} {values[ENTRY_TYPES[i % len(ENTRY_TYPES)]]}" for i in range(controls)]
+    sample.append("UNKNOWN_CONTROL 1")
+    stream = [sample[i % len(sample)] for i in range(lines)]
+    lookup = engine.lookup
+    start = time.perf_counter()
+    for line in stream:
+        lookup(line)
+    elapsed = time.perf_counter() - start
+    print(f"{len(engine)} controls: {elapsed / lines * 1e9:.0f} ns per line, {lines / elapsed:,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    benchmark_dispatch()
@@ -1,75 +1,195 @@
 import serial
 import time
 import json
+import queue
 from threading import Thread, Event
 import socket
 import sys
-import struct
-import errno
 
 from dcs_bios_reader import ProtocolParser
-from falcon_bms_reader import read_shared_memory, FlightData, FlightData2, IntellivibeData, read_shared_memory_strings
+from falcon_bms_reader import FlightData, FlightData2, IntellivibeData, SharedMemoryReader, backend_from_config
+from bms_poller import AdaptivePoller
 from callbacks import Callbacks
 from ded_handler import DEDHandler
 from BMSKeyHandler import FalconBMSHandler
+from key_injector import injector_backend_from_config
+from scheduler import Scheduler
+from dcs_bios_receiver import DcsBiosReceiver
+from dcs_bios_process import DecoderProcess
+from dcs_bios_controls import ControlIndex, ControlRegistry
+from dcs_bios_passthrough import ExportForwarder, DeviceStream, parse_address_ranges
+from dcs_bios_encoder import ExportEncoder
+from recording import Recorder, Replayer, ReplayBackend
+from serial_io import SerialWriter, SerialReader
+from latency import tracer
+from state_store import StateStore
+from log import get_logger, setup_logging, shutdown_logging
+
+log = get_logger("input")
 
 
 class ArduinoConnection:
-    def __init__(self, name, com_port, baud_rate):
+    def __init__(self, name, com_port, baud_rate, protocol="text", rows=2, columns=16, keyframe_interval=2.0,
+                 input_queue=None, on_line=None, read_timeout=0.1):
         self.name = name
         self.com_port = com_port
         self.baud_rate = baud_rate
+        # "text" sends "line1,line2\n", "binary" sends ded_protocol frames,
+        # "dcs-bios" forwards the DCS-BIOS export stream for the board's address ranges
+        self.protocol = protocol
+        self.rows = rows
+        self.columns = columns
+        self.keyframe_interval = keyframe_interval
         self.serial_conn = serial.Serial(
             port=com_port,
             baudrate=baud_rate,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
             bytesize=serial.EIGHTBITS,
-            timeout=None,
+            timeout=read_timeout,  # Only bounds how long the reader thread takes to stop
+            write_timeout=None,
             rtscts=False,
             dsrdtr=False
         )
+        self.writer = SerialWriter(name, self.serial_conn, baud_rate)
+        self.reader = None
+        if input_queue is not None:
+            self.reader = SerialReader(name, self.serial_conn, input_queue, on_line)
 
-    def send_data(self, data):
-        self.serial_conn.write(data.encode() + b'\n')
+    def send_data(self, data, key=None, stamp=None):
+        # Queued on the device's writer thread; messages with the same key coalesce
+        self.writer.send(data.encode() + b'\n', key, stamp)
 
+    def send_bytes(self, data, key=None, stamp=None):
+        self.writer.send(data, key, stamp)
 
-    def read_data(self):
-        if self.serial_conn.in_waiting > 0:
-            line = self.serial_conn.readline().decode('utf-8').strip()
-            print(f"Received from {self.name}: {line}")
-            return line
-        return None
+    def stats(self):
+        stats = self.writer.stats()
+        if self.reader:
+            stats.update({"read_" + key: value for key, value in self.reader.stats().items()})
+        return stats
+
+    def close(self):
+        self.writer.stop()
+        if self.reader:
+            self.reader.stop()
+        self.serial_conn.close()
 
 
 class Middleware:
     def __init__(self, config_path, mode):
         self.load_config(config_path)
         self.mode = mode
+        setup_logging(self.config.get("logging"))
+        # Off unless configured, stamps then cost nothing
+        tracer.enabled = self.config.get("latency", {}).get("enabled", False)
+        self.scheduler = Scheduler()
+        # Lines from every Arduino fan in here, tagged with device name and receive time
+        self.input_queue = queue.Queue(maxsize=1024)
+        self.input_handlers = {}
         self.arduino_connections = {
-            arduino["name"]: ArduinoConnection(arduino["name"], arduino["com_port"], arduino["baud_rate"]) for arduino
-            in self.config["arduinos"]}
-        self.shared_data = {}
-        self.shared_data["BMS_flightdata"] = None
-        self.shared_data["BMS_flightdata2"] = None
-        self.shared_data["BMS_intellivibe"] = None
-        self.shared_data["BMS_strings"] = None
-        self.shared_data["DCS"] = {}
+            arduino["name"]: ArduinoConnection(arduino["name"], arduino["com_port"], arduino["baud_rate"],
+                                               arduino.get("protocol", "text"), arduino.get("rows", 2),
+                                               arduino.get("columns", 16), arduino.get("keyframe_interval", 2.0),
+                                               self.input_queue, lambda: self.scheduler.signal("input"))
+            for arduino in self.config["arduinos"]}
+        # Versioned state: "DCS" is committed at the end of every DCS-BIOS
+        # frame, "BMS" at the end of every shared memory read
+        self.state = StateStore()
+        self.state.define("BMS", {"flightdata": None, "flightdata2": None, "intellivibe": None,
+                                  "strings": None, "stamp": None})
+        self.state.define("DCS", {"DED_line1": "", "DED_line2": "", "DED_stamp": None})
         self.parser = ProtocolParser()
+        self.controls = None
+        self.export_forwarder = None
+        self.export_encoder = None
         self.dcs_thread = None
+        self.dcs_receiver = None
+        self.dcs_decoder = None
         self.stop_event = Event()
         self.socket = None
         self.bms_handler = None
+        self.bms_reader = None
+        self.bms_poller = None
+        self.replay_thread = None
+        self.setup_recording()
+
+        aircraft_json = self.config.get("dcs_bios", {}).get("aircraft_json")
+        if aircraft_json:
+            self.controls = ControlRegistry(self.parser, ControlIndex.load(aircraft_json))
+        self.setup_export_forwarder()
 
         if self.mode == 'DCS':
-            self.callbacks = Callbacks(self.parser, self.shared_data)
-            self.start_dcs_thread()
+            self.callbacks = Callbacks(self.parser, self.state, self.controls)
+            # Registered after the buffers, so the frame's strings are staged first
+            self.parser.add_address_callback(0xfffe, 1, lambda address, data: self.state.commit("DCS"))
+            self.parser.frame_sync_callbacks.add(lambda: self.state.commit("DCS"))
         elif self.mode == 'BMS':
-            self.bms_handler = FalconBMSHandler()
+            self.bms_handler = FalconBMSHandler(injector_backend=injector_backend_from_config(self.config),
+                                                axes_config=self.config.get("axes"),
+                                                mappings_path=self.config.get("mappings_file", "mappings.json"))
+            if self.replayer:
+                self.bms_reader = SharedMemoryReader(ReplayBackend())
+            else:
+                self.bms_reader = SharedMemoryReader(backend_from_config(self.config))
+            if self.export_forwarder:
+                # BMS data is encoded as a DCS-BIOS stream and fed through the same
+                # parser and forwarder, so the boards cannot tell which sim is running
+                bms_config = self.config.get("bms", {})
+                self.export_encoder = ExportEncoder.from_file(
+                    bms_config.get("export_file", "bms_export.json"),
+                    self.controls.index if self.controls else None,
+                    bms_config.get("export_refresh_interval", 5.0))
 
 
         # Initialize handlers for different components
-        self.ded_handler = DEDHandler(self.arduino_connections["DED"], self.mode, self.shared_data, self)
+        self.ded_handler = DEDHandler(self.arduino_connections["DED"], self.mode, self.state, self)
+        self.input_handlers["DED"] = self.ded_handler.process_input
+        self.setup_scheduler()
+
+        # Sources start last: a replay at max speed would otherwise signal
+        # tasks the scheduler does not know about yet
+        if self.mode == 'DCS':
+            self.start_dcs_thread()
+        elif self.replayer:
+            self.start_replay_thread(backend=self.bms_reader.backend)
+
+    def setup_export_forwarder(self):
+        index = self.controls.index if self.controls else None
+        devices = [
+            DeviceStream(arduino["name"], self.arduino_connections[arduino["name"]],
+                         parse_address_ranges(arduino, index))
+            for arduino in self.config["arduinos"] if arduino.get("protocol") == "dcs-bios"
+        ]
+        if devices:
+            self.export_forwarder = ExportForwarder(self.parser, devices)
+
+    def setup_recording(self):
+        # "record_file" captures the live DCS-BIOS stream or BMS shared memory,
+        # "replay_file" plays one back instead of talking to the sim
+        recording = self.config.get("recording", {})
+        self.recorder = None
+        self.replayer = None
+        if recording.get("replay_file"):
+            self.replayer = Replayer(recording["replay_file"])
+            self.replay_speed = recording.get("replay_speed", 1.0)
+            self.replay_start = recording.get("replay_start", 0.0)
+            print(f"Replaying {recording['replay_file']} at {self.replay_speed or 'max'}x")
+        elif recording.get("record_file"):
+            self.recorder = Recorder(recording["record_file"], recording.get("keyframe_interval", 10.0))
+            print(f"Recording to {recording['record_file']}")
+
+    def start_replay_thread(self, backend):
+        self.replay_thread = Thread(target=self.replay, kwargs={"backend": backend})
+        self.replay_thread.start()
+
+    def replay(self, on_datagram=None, backend=None):
+        try:
+            self.replayer.play(on_datagram, backend, speed=self.replay_speed,
+                               start=self.replay_start, stop_event=self.stop_event)
+            print("Replay finished")
+        except Exception as e:
+            print("Replay stopped:", e)
 
     def load_config(self, config_path):
         with open(config_path, 'r') as f:
@@ -80,26 +200,132 @@ class Middleware:
             self.arduino_connections[name].send_data(data)
 
     def read_falcon_data(self):
-        flightdata = read_shared_memory(FlightData)
-        flightdata2 = read_shared_memory(FlightData2)
-        strings = read_shared_memory_strings()
-        # put data in shared_data
-        self.shared_data["BMS_flightdata"] = flightdata
-        self.shared_data["BMS_flightdata2"] = flightdata2
-        self.shared_data["BMS_strings"] = strings
-
-
-    def run(self):
+        # The store gets private copies, so a reader holding a snapshot never
+        # sees BMS write into it. Only areas the poller saw change get a new
+        # copy, made from the bytes it already read for its compare.
+        values = {}
+        poller = self.bms_poller
+        for key, structure in (("flightdata", FlightData), ("flightdata2", FlightData2),
+                               ("intellivibe", IntellivibeData)):
+            if structure in poller.changed_areas:
+                values[key] = structure.from_buffer_copy(poller.previous[structure])
+        if values:
+            values["strings"] = self.bms_reader.strings()
+            values["stamp"] = tracer.mark("bms")
+        # publish the tick's data as one version
+        self.state.update("BMS", values)
+        self.state.commit("BMS")
+        # Fire change callbacks for fields handlers subscribed to
+        self.bms_reader.dispatch_changes()
+
+    def setup_scheduler(self):
+        rates = self.config.get("scheduler", {})
+        if self.mode == 'DCS':
+            # DED output only needs to run once the parser has finished a frame.
+            # 0xfffe is the end-of-update write that closes every DCS-BIOS frame.
+            self.scheduler.add_task("ded", self.ded_handler.process_output, rates.get("ded_max_rate", 60))
+            self.parser.add_address_callback(0xfffe, 1, lambda address, data: self.scheduler.signal("ded"))
+            self.parser.frame_sync_callbacks.add(lambda: self.scheduler.signal("ded"))
+        elif self.mode == 'BMS':
+            self.scheduler.add_task("bms", self.process_falcon_data, rates.get("bms_poll_rate", 50), periodic=True)
+            # Drops the "bms" task to bms_idle_rate outside 3D and skips ticks
+            # where the mapped areas did not change
+            self.bms_poller = AdaptivePoller(self.bms_reader,
+                                             rates.get("bms_poll_rate", 50),
+                                             rates.get("bms_idle_rate", 2),
+                                             rates.get("bms_active_hold", 2.0),
+                                             rates.get("bms_max_skip_interval", 1.0),
+                                             lambda rate: self.scheduler.set_rate("bms", rate))
+            # Signalled by pot updates, flushed to vJoy at most axis_flush_rate times a second
+            self.scheduler.add_task("axes", self.bms_handler.flush_axes, rates.get("axis_flush_rate", 100))
+            self.bms_handler.axes.on_update = lambda: self.scheduler.signal("axes")
+        # Woken by the serial reader threads whenever a line arrives
+        self.scheduler.add_task("input", self.process_input)
+        stats_interval = rates.get("stats_interval", 0)
+        if stats_interval:
+            self.scheduler.add_task("stats", self.print_stats, 1.0 / stats_interval, periodic=True)
+        report_interval = self.config.get("latency", {}).get("report_interval", 0)
+        if tracer.enabled and report_interval:
+            self.scheduler.add_task("latency", tracer.print_report, 1.0 / report_interval, periodic=True)
+
+    def process_input(self):
         while True:
-            if self.mode == 'DCS':
-                # Process data using the DED handler
-                self.ded_handler.process_data()
-                #self.send_message_to_dcs("MMC_PWR_SW", 1)
-            elif self.mode == 'BMS':
-                self.read_falcon_data()
-                # Process BMS data using the DED handler
-                self.ded_handler.process_data()
+            try:
+                input_line = self.input_queue.get_nowait()
+            except queue.Empty:
+                return
+            log.debug("Received from %s: %s", input_line.device, input_line.line)
+            if self.bms_poller:
+                self.bms_poller.activity()
+            handler = self.input_handlers.get(input_line.device, self.forward_input)
+            handler(input_line)
+
+    def forward_input(self, input_line):
+        # Default route for devices without a dedicated handler
+        stamp = tracer.stamp("serial", input_line.timestamp, input_line.device)
+        if self.mode == 'DCS':
+            self.send_message_to_dcs(input_line.line, stamp)
+        elif self.mode == 'BMS':
+            self.bms_handler.send_key(input_line.line, stamp)
+
+    def print_stats(self):
+        self.scheduler.print_stats()
+        for name, connection in self.arduino_connections.items():
+            stats = connection.stats()
+            print(f"  {name}: queued {stats['queued']}, coalesced {stats['coalesced']}, "
+                  f"dropped {stats['dropped']}, written {stats['written_bytes']} bytes in {stats['writes']} writes")
+        if self.dcs_decoder:
+            stats = self.dcs_decoder.stats()
+            print(f"  DCS-BIOS decoder: {stats['datagrams']} datagrams, {stats['frames']} frames, "
+                  f"{stats['writes_out']} of {stats['writes_in']} writes changed, "
+                  f"{stats['dropped_frames']} ring full, ring p99 {stats['ring_p99_ms']:.2f}ms")
+        if self.bms_poller:
+            stats = self.bms_poller.stats()
+            print(f"  BMS poller: {stats['state']} at {stats['rate']} Hz, {stats['processed']} changed, "
+                  f"{stats['forced']} forced, {stats['skipped']} skipped of {stats['polls']} polls "
+                  f"({stats['idle_polls']} idle)")
+
+    def process_falcon_data(self):
+        if not self.bms_poller.poll():
+            return
+        self.read_falcon_data()
+        if self.recorder:
+            self.recorder.record_snapshots(self.bms_reader)
+        if self.export_encoder:
+            self.parser.feed(self.export_encoder.encode({
+                "FlightData": self.state.get("BMS", "flightdata"),
+                "FlightData2": self.state.get("BMS", "flightdata2"),
+            }))
+        # Process BMS data using the DED handler
+        self.ded_handler.process_output()
 
+    def run(self):
+        try:
+            self.scheduler.run(self.stop_event)
+        except KeyboardInterrupt:
+            print("Stopping middleware")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        self.scheduler.wake()
+        self.stop_dcs_thread()
+        if self.replay_thread:
+            self.replay_thread.join()
+        if self.recorder:
+            self.recorder.close()
+        if self.bms_reader:
+            self.bms_reader.close()
+        if self.bms_handler:
+            self.bms_handler.injector.stop()
+        for connection in self.arduino_connections.values():
+            connection.close()
+        if tracer.enabled:
+            tracer.print_report()
+        if self.replayer:
+            self.replayer.close()
+        shutdown_logging()
 
     def start_dcs_thread(self):
         self.stop_event.clear()
@@ -112,54 +338,37 @@ class Middleware:
             self.dcs_thread.join()
             self.dcs_thread = None
 
-    import struct
-    import errno
-
     def start_dcs_reader(self):
-        CONNECTION = {
-            "type": "UDP",
-            "multicast_group": "239.255.50.10",
-            "port": 5010
-        }
-
-        if CONNECTION["type"] == "UDP":
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(("0.0.0.0", CONNECTION["port"]))
-
-            # Join multicast group
-            mreq = struct.pack("4sl", socket.inet_aton(CONNECTION["multicast_group"]), socket.INADDR_ANY)
-            s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-            s.settimeout(0)  # Set the socket to non-blocking mode
-
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        print("DCS reader started")
-        print("Listening on port", CONNECTION["port"])
-        print(f"Joined multicast group {CONNECTION['multicast_group']}")
-
-        while not self.stop_event.is_set():
-            try:
-                data, addr = s.recvfrom(8192)
-                if data:
-                    for c in data:
-                        self.parser.processByte(bytes([c]))  # Ensure each byte is passed correctly
-            except socket.error as e:
-                if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
-                    # These are expected errors for non-blocking sockets when no data is available
-                    continue
-                else:
-                    print("Socket error:", e)
-            except Exception as e:
-                print("Unexpected error:", e)
+        if self.replayer:
+            # Datagrams replayed on this thread, exactly where the receiver would feed them
+            self.replay(self.parser.feed)
+            return
+        decoder = self.config.get("dcs_bios", {}).get("decoder", "thread")
+        if decoder == "process" and self.recorder:
+            print("Recording needs the raw datagrams, using the threaded DCS-BIOS decoder")
+            decoder = "thread"
+        try:
+            if decoder == "process":
+                # Receive and parse in a worker process, dispatch its decoded writes here
+                self.dcs_decoder = DecoderProcess.from_config(self.parser, self.stop_event, self.config)
+                self.dcs_decoder.run()
+                return
+            self.dcs_receiver = DcsBiosReceiver.from_config(self.parser, self.stop_event, self.config)
+            self.dcs_receiver.recorder = self.recorder
+            self.dcs_receiver.run()
+        except Exception as e:
+            print("DCS reader stopped:", e)
 
-    def send_message_to_dcs(self, message):
+    def send_message_to_dcs(self, message, stamp=None):
         udp_receiver_ip = '127.0.0.1'
         port = 7778
 
         try:
             self.socket.sendto(bytes(str(message) + '\n', "utf-8"), (udp_receiver_ip, port))
+            tracer.record(stamp, "dcs")
         except Exception as e:
-            print(f"Error sending message to DCS: {e}")
+            log.error("Error sending message to DCS: %s", e)
 
 
     def console_test(self):
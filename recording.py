@@ -0,0 +1,345 @@
+import bisect
+import ctypes
+import mmap
+import struct
+import sys
+import threading
+import time
+
+from falcon_bms_reader import FlightData, FlightData2, IntellivibeData, Strings
+
+# Recording file layout, all little endian and append-only:
+#   file header: magic, version, area count, wall clock start, then one
+#                uint32 structure size per area (replay refuses recordings
+#                made with a different structure layout)
+#   records:     timestamp (seconds since start), kind, area, payload length,
+#                followed by the payload
+# A DELTA payload is a list of (offset, length) runs, each followed by the
+# new bytes. A MARK record starts a group of KEYFRAMEs for every area, which
+# is where a seek can start from. Recordings of DCS-BIOS datagrams only get a
+# MARK every keyframe interval as well; the stream needs no keyframes since
+# DCS-BIOS resends its whole export memory over time.
+MAGIC = b"DBRC"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHd")
+AREA_SIZE = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<dBBI")
+DELTA_RUN = struct.Struct("<IH")
+
+DATAGRAM = 1
+KEYFRAME = 2
+DELTA = 3
+MARK = 4
+
+AREAS = (FlightData, FlightData2, IntellivibeData)
+
+
+def diff_runs(old, new, block_size=16):
+    # (start, end) byte ranges of new that differ from old, compared block-wise
+    # so a handful of changed floats do not turn into one run per byte
+    runs = []
+    start = None
+    size = len(new)
+    for offset in range(0, size, block_size):
+        end = offset + block_size
+        if old[offset:end] != new[offset:end]:
+            if start is None:
+                start = offset
+        elif start is not None:
+            runs.append((start, offset))
+            start = None
+    if start is not None:
+        runs.append((start, size))
+    return runs
+
+
+def encode_delta(runs, new):
+    parts = []
+    for start, end in runs:
+        parts.append(DELTA_RUN.pack(start, end - start))
+        parts.append(new[start:end])
+    return b"".join(parts)
+
+
+def apply_delta(target, payload):
+    offset = 0
+    while offset < len(payload):
+        start, length = DELTA_RUN.unpack_from(payload, offset)
+        offset += DELTA_RUN.size
+        target[start:start + length] = payload[offset:offset + length]
+        offset += length
+
+
+class Recorder:
+    # Appends raw DCS-BIOS datagrams and BMS shared memory snapshots to a
+    # recording. Unchanged snapshots cost nothing, changed ones are stored as
+    # block deltas against the previous one, with a full keyframe of every
+    # area each keyframe_interval seconds.
+    def __init__(self, path, keyframe_interval=10.0, block_size=16):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.block_size = block_size
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(AREAS), time.time()))
+        for structure in AREAS:
+            self.file.write(AREA_SIZE.pack(ctypes.sizeof(structure)))
+        self.start = time.monotonic()
+        self.previous = [None] * len(AREAS)
+        self.last_keyframe = None
+        self.last_mark = None
+        self.counters = {
+            "datagrams": 0,
+            "keyframes": 0,
+            "deltas": 0,
+            "unchanged": 0,
+            "snapshot_bytes": 0,
+            "written_bytes": self.file.tell(),
+        }
+        # Datagrams come from the DCS reader thread, snapshots from the scheduler
+        self._lock = threading.Lock()
+
+    def _write(self, timestamp, kind, area, payload):
+        self.file.write(RECORD_HEADER.pack(timestamp, kind, area, len(payload)))
+        self.file.write(payload)
+        self.counters["written_bytes"] += RECORD_HEADER.size + len(payload)
+
+    def record_datagram(self, data, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # Once snapshots are recorded, only they write MARKs, so every MARK
+            # is still followed by complete keyframes
+            if self.last_keyframe is None and (self.last_mark is None
+                                               or now - self.last_mark >= self.keyframe_interval):
+                self.last_mark = now
+                self._write(now - self.start, MARK, 0, b"")
+            self._write(now - self.start, DATAGRAM, 0, data)
+            self.counters["datagrams"] += 1
+
+    def record_snapshots(self, reader, now=None):
+        # Records every BMS area the SharedMemoryReader has mapped
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            keyframe = self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval
+            if keyframe:
+                self.last_keyframe = now
+                self._write(now - self.start, MARK, 0, b"")
+            for area, structure in enumerate(AREAS):
+                buffer = reader.buffer(structure)
+                if buffer is None:
+                    continue
+                with buffer:
+                    data = bytes(buffer[:ctypes.sizeof(structure)])
+                self._record_snapshot(now, area, data, keyframe)
+
+    def _record_snapshot(self, now, area, data, keyframe):
+        self.counters["snapshot_bytes"] += len(data)
+        previous = self.previous[area]
+        if previous is None or len(previous) != len(data):
+            keyframe = True
+        elif not keyframe:
+            if data == previous:
+                self.counters["unchanged"] += 1
+                return
+            payload = encode_delta(diff_runs(previous, data, self.block_size), data)
+            # A delta touching most of the area is no smaller than the area itself
+            keyframe = len(payload) >= len(data)
+        self.previous[area] = data
+        if keyframe:
+            self._write(now - self.start, KEYFRAME, area, data)
+            self.counters["keyframes"] += 1
+        else:
+            self._write(now - self.start, DELTA, area, payload)
+            self.counters["deltas"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def close(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class ReplayBackend():
+    # SharedMemoryReader backend whose areas are filled by a Replayer instead
+    # of BMS. Areas are anonymous mmaps, so views, buffers and close() behave
+    # exactly like the real shared memory.
+    def __init__(self):
+        self.areas = {structure.name: mmap.mmap(-1, ctypes.sizeof(structure)) for structure in AREAS}
+        # Strings are not recorded; serve a valid area where every string is empty
+        strings = mmap.mmap(-1, Strings.area_size_max)
+        strings[:Strings.header.size] = Strings.header.pack(0, len(Strings.id), len(Strings.id))
+        offset = Strings.header.size
+        for i in range(len(Strings.id)):
+            strings[offset:offset + Strings.entry.size] = Strings.entry.pack(i, 0)
+            offset += Strings.entry.size + 1
+        self.areas[Strings.name] = strings
+
+    def open(self, name, size):
+        sm = self.areas.get(name)
+        if sm is None:
+            raise ValueError("{} is not part of the recording".format(name))
+        return sm
+
+    def area(self, index):
+        return self.areas[AREAS[index].name]
+
+    def __repr__(self):
+        return "ReplayBackend()"
+
+
+class Replayer:
+    # Plays a recording back through the same entry points the live sources
+    # use: datagrams go to on_datagram (normally ProtocolParser.feed) and
+    # snapshots are written into a ReplayBackend. The file is memory mapped and
+    # walked record by record, so hour-long recordings need no extra memory.
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, area_count, self.start_time = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} recording".format(path, VERSION))
+        offset = FILE_HEADER.size
+        self.area_sizes = []
+        for _ in range(area_count):
+            self.area_sizes.append(AREA_SIZE.unpack_from(self.mm, offset)[0])
+            offset += AREA_SIZE.size
+        # Snapshots are replayed as raw bytes, so a different layout would
+        # misalign every field after the first difference
+        if area_count != len(AREAS):
+            self.mm.close()
+            raise ValueError("{} has {} areas, expected {}".format(path, area_count, len(AREAS)))
+        for structure, size in zip(AREAS, self.area_sizes):
+            if size != ctypes.sizeof(structure):
+                self.mm.close()
+                raise ValueError("{} has {} bytes of {}, this layout has {}".format(
+                    path, size, structure.__name__, ctypes.sizeof(structure)))
+        self.data_offset = offset
+        self.marks = None  # [(timestamp, offset)] of every MARK, built on first seek
+        self.end_timestamp = None
+
+    def build_index(self):
+        # One pass over the record headers only; payloads are never touched
+        mm = self.mm
+        size = len(mm)
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        marks = []
+        timestamp = 0.0
+        offset = self.data_offset
+        while offset + header_size <= size:
+            timestamp, kind, area, length = unpack_from(mm, offset)
+            if kind == MARK:
+                marks.append((timestamp, offset))
+            offset += header_size + length
+        self.marks = marks
+        self.end_timestamp = timestamp
+        return marks
+
+    def duration(self):
+        if self.end_timestamp is None:
+            self.build_index()
+        return self.end_timestamp
+
+    def seek_offset(self, timestamp):
+        # Offset of the last keyframe group at or before timestamp
+        if timestamp <= 0:
+            return self.data_offset
+        if self.marks is None:
+            self.build_index()
+        i = bisect.bisect_right(self.marks, (timestamp, float("inf"))) - 1
+        return self.marks[i][1] if i >= 0 else self.data_offset
+
+    def records(self, start=0.0):
+        # Yields (timestamp, kind, area, payload) from the keyframe group
+        # before start. A record cut short by a crashed recorder ends the replay.
+        mm = self.mm
+        view = memoryview(mm)
+        size = len(mm)
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        offset = self.seek_offset(start)
+        payload = None
+        try:
+            while offset + header_size <= size:
+                timestamp, kind, area, length = unpack_from(mm, offset)
+                offset += header_size
+                if offset + length > size:
+                    return
+                payload = view[offset:offset + length]
+                yield timestamp, kind, area, payload
+                payload.release()
+                offset += length
+        finally:
+            if payload is not None:
+                payload.release()
+            view.release()
+
+    def play(self, on_datagram=None, backend=None, on_snapshot=None, speed=1.0, start=0.0, stop_event=None):
+        # speed 1.0 is real time, 4.0 four times faster, 0 or None as fast as
+        # possible. Snapshots before start are applied silently so the areas
+        # are complete; datagrams before start are skipped, DCS-BIOS resends
+        # its whole export memory over time anyway.
+        base = None
+        played = 0
+        for timestamp, kind, area, payload in self.records(start):
+            if stop_event is not None and stop_event.is_set():
+                break
+            catching_up = timestamp < start
+            if not catching_up and speed:
+                now = time.monotonic()
+                if base is None:
+                    base = now - timestamp / speed
+                delay = base + timestamp / speed - now
+                if delay > 0:
+                    if stop_event is not None:
+                        if stop_event.wait(delay):
+                            break
+                    else:
+                        time.sleep(delay)
+            if kind == DATAGRAM:
+                if not catching_up and on_datagram:
+                    on_datagram(payload)
+                    played += 1
+            elif kind in (KEYFRAME, DELTA) and backend is not None:
+                target = backend.area(area)
+                if kind == KEYFRAME:
+                    target[:len(payload)] = payload
+                else:
+                    apply_delta(target, payload)
+                if not catching_up and on_snapshot:
+                    on_snapshot(AREAS[area])
+                played += 1
+        return played
+
+    def close(self):
+        self.mm.close()
+
+
+def summarise(path):
+    replayer = Replayer(path)
+    counts = {DATAGRAM: 0, KEYFRAME: 0, DELTA: 0, MARK: 0}
+    stored = {DATAGRAM: 0, KEYFRAME: 0, DELTA: 0, MARK: 0}
+    snapshots = 0
+    snapshot_bytes = 0
+    for timestamp, kind, area, payload in replayer.records():
+        counts[kind] += 1
+        stored[kind] += len(payload)
+        if kind in (KEYFRAME, DELTA):
+            snapshots += 1
+            snapshot_bytes += replayer.area_sizes[area]
+    print(f"{path}: {replayer.duration():.1f} s, {len(replayer.mm)} bytes, recorded "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(replayer.start_time))}")
+    print(f"  {counts[DATAGRAM]} DCS-BIOS datagrams, {stored[DATAGRAM]} bytes")
+    print(f"  {snapshots} BMS snapshots: {counts[KEYFRAME]} keyframes, {counts[DELTA]} deltas, "
+          f"{stored[KEYFRAME] + stored[DELTA]} of {snapshot_bytes} bytes stored")
+    replayer.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python recording.py <recording>")
+        sys.exit(1)
+    summarise(sys.argv[1])
@@ -0,0 +1,169 @@
+import threading
+import time
+
+from log import get_logger
+
+log = get_logger("scheduler")
+
+
+class Task:
+    def __init__(self, name, func, rate=None, periodic=False):
+        self.name = name
+        self.func = func
+        self.periodic = periodic
+        # Target rate in Hz. Periodic tasks run at this rate, event tasks are
+        # never run more often than this no matter how often they are signalled.
+        self.interval = 1.0 / rate if rate else 0.0
+        self.pending = False
+        self.signalled_at = 0.0
+        self.last_run = 0.0
+        self.next_run = 0.0
+        self.runs = 0
+        self.busy_time = 0.0
+        self.max_time = 0.0
+        self.max_lateness = 0.0
+
+    def due_at(self):
+        if self.periodic:
+            return self.next_run
+        if self.pending:
+            return max(self.signalled_at, self.last_run + self.interval)
+        return None
+
+    def reset_stats(self):
+        self.runs = 0
+        self.busy_time = 0.0
+        self.max_time = 0.0
+        self.max_lateness = 0.0
+
+
+class Scheduler:
+    def __init__(self, idle_timeout=1.0):
+        self.idle_timeout = idle_timeout
+        self.tasks = {}
+        self._condition = threading.Condition()
+        self._wakeups = 0
+        self._idle_time = 0.0
+        self._stats_since = time.monotonic()
+
+    def add_task(self, name, func, rate=None, periodic=False):
+        if periodic and not rate:
+            raise ValueError(f"Periodic task '{name}' needs a rate")
+        with self._condition:
+            task = Task(name, func, rate, periodic)
+            task.next_run = time.monotonic()
+            self.tasks[name] = task
+            self._condition.notify()
+        return task
+
+    def signal(self, name):
+        # Safe to call from any thread, e.g. the DCS reader or a serial reader.
+        with self._condition:
+            task = self.tasks.get(name)
+            if task is not None and not task.pending:
+                task.pending = True
+                task.signalled_at = time.monotonic()
+                self._condition.notify()
+
+    def set_rate(self, name, rate):
+        # Safe to call from any thread, including from the task itself
+        with self._condition:
+            task = self.tasks.get(name)
+            if task is None:
+                return
+            if task.periodic and not rate:
+                raise ValueError(f"Periodic task '{name}' needs a rate")
+            interval = 1.0 / rate if rate else 0.0
+            if interval == task.interval:
+                return
+            task.interval = interval
+            if task.periodic:
+                # A faster rate takes effect now, not after the old interval
+                task.next_run = min(task.next_run, time.monotonic() + interval)
+            self._condition.notify()
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            due = self._wait_for_due_tasks()
+            for task, due_at in due:
+                start = time.monotonic()
+                try:
+                    task.func()
+                except Exception as e:
+                    log.exception("Task '%s' failed: %s", task.name, e)
+                end = time.monotonic()
+                elapsed = end - start
+                task.runs += 1
+                task.busy_time += elapsed
+                task.max_time = max(task.max_time, elapsed)
+                task.max_lateness = max(task.max_lateness, start - due_at)
+
+    def _wait_for_due_tasks(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = []
+                next_due = None
+                for task in self.tasks.values():
+                    due_at = task.due_at()
+                    if due_at is None:
+                        continue
+                    if due_at <= now:
+                        due.append((task, due_at))
+                    elif next_due is None or due_at < next_due:
+                        next_due = due_at
+                if due:
+                    for task, due_at in due:
+                        task.pending = False
+                        task.last_run = now
+                        if task.periodic:
+                            # Skip missed ticks instead of bursting to catch up
+                            task.next_run = max(task.next_run + task.interval, now)
+                    self._wakeups += 1
+                    return due
+                timeout = self.idle_timeout if next_due is None else min(next_due - now, self.idle_timeout)
+                self._condition.wait(timeout)
+                self._idle_time += time.monotonic() - now
+                if timeout >= self.idle_timeout:
+                    # Give the caller a chance to check its stop event
+                    return []
+
+    def stats(self):
+        now = time.monotonic()
+        window = max(now - self._stats_since, 1e-9)
+        tasks = {}
+        for name, task in self.tasks.items():
+            tasks[name] = {
+                "runs": task.runs,
+                "rate": task.runs / window,
+                "avg_ms": task.busy_time / task.runs * 1000.0 if task.runs else 0.0,
+                "max_ms": task.max_time * 1000.0,
+                "max_lateness_ms": task.max_lateness * 1000.0,
+            }
+        return {
+            "window_s": window,
+            "wakeups": self._wakeups,
+            "idle_fraction": min(self._idle_time / window, 1.0),
+            "tasks": tasks,
+        }
+
+    def reset_stats(self):
+        with self._condition:
+            for task in self.tasks.values():
+                task.reset_stats()
+            self._wakeups = 0
+            self._idle_time = 0.0
+            self._stats_since = time.monotonic()
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Scheduler: {stats['wakeups']} wakeups in {stats['window_s']:.1f}s, "
+              f"idle {stats['idle_fraction'] * 100:.1f}%")
+        for name, task in stats["tasks"].items():
+            print(f"  {name}: {task['runs']} runs ({task['rate']:.1f}/s), avg {task['avg_ms']:.2f}ms, "
+                  f"max {task['max_ms']:.2f}ms, max late {task['max_lateness_ms']:.2f}ms")
+        self.reset_stats()
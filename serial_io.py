@@ -0,0 +1,178 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from latency import tracer
+from log import get_logger
+
+log = get_logger("serial")
+
+# One line received from an Arduino, tagged with where and when it arrived
+InputLine = namedtuple("InputLine", ["device", "line", "timestamp"])
+
+
+class SerialWriter:
+    # Writes to one serial port from its own thread. Messages sent with a key
+    # are coalesced: a newer DED frame replaces the older one if it has not
+    # been written yet, so the Arduino never has to chew through stale frames.
+    def __init__(self, name, serial_conn, baud_rate, max_pending=64, max_out_waiting=256):
+        self.name = name
+        self.serial_conn = serial_conn
+        self.byte_time = 10.0 / baud_rate  # start + 8 data + stop bits
+        self.max_pending = max_pending
+        self.max_out_waiting = max_out_waiting
+        self.counters = {
+            "queued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "writes": 0,
+            "written_bytes": 0,
+        }
+        self._outbox = OrderedDict()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f"serial-writer-{name}", daemon=True)
+        self._thread.start()
+
+    def send(self, data, key=None, stamp=None):
+        # stamp is the latency.Stamp of the data this message was built from
+        with self._condition:
+            if key is None:
+                key = (None, next(self._sequence))  # Unkeyed messages are never coalesced
+            if key in self._outbox:
+                self.counters["coalesced"] += 1
+                older = self._outbox[key][1]
+                if older is not None:
+                    stamp = older  # Latency counts from the first change that is still unsent
+            elif len(self._outbox) >= self.max_pending:
+                self._outbox.popitem(last=False)
+                self.counters["dropped"] += 1
+            self._outbox[key] = (data, stamp)
+            self.counters["queued"] += 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self.counters)
+            stats["pending"] = len(self._outbox)
+        return stats
+
+    def stop(self, timeout=1.0):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _out_waiting(self):
+        try:
+            return self.serial_conn.out_waiting
+        except (AttributeError, NotImplementedError, OSError):
+            return 0
+
+    def _wait_for_room(self):
+        # Backpressure: leave messages in the outbox (where they can still be
+        # coalesced) while the driver's transmit buffer is full.
+        while not self._stopped:
+            waiting = self._out_waiting()
+            if waiting <= self.max_out_waiting:
+                return
+            time.sleep((waiting - self.max_out_waiting) * self.byte_time)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._outbox and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+            self._wait_for_room()
+            with self._condition:
+                if not self._outbox:
+                    continue
+                key, (data, stamp) = self._outbox.popitem(last=False)
+            try:
+                written = self.serial_conn.write(data)
+            except OSError as e:
+                log.error("Error writing to %s: %s", self.name, e)
+                with self._condition:
+                    self.counters["dropped"] += 1
+                continue
+            # Handed to the driver; the rest is wire time at the port's baud rate
+            tracer.record(stamp, "serial", self.name)
+            with self._condition:
+                self.counters["writes"] += 1
+                self.counters["written_bytes"] += written if written is not None else len(data)
+
+
+class SerialReader:
+    # Reads one serial port from its own thread in bulk and splits lines itself,
+    # so a partial line never blocks anyone. Complete lines go into a queue
+    # shared by all devices; on_line is called after each put to wake the consumer.
+    def __init__(self, name, serial_conn, input_queue, on_line=None, max_line_length=1024):
+        self.name = name
+        self.serial_conn = serial_conn
+        self.input_queue = input_queue
+        self.on_line = on_line
+        self.max_line_length = max_line_length
+        self.counters = {
+            "lines": 0,
+            "bytes": 0,
+            "dropped": 0,
+        }
+        self._partial = bytearray()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f"serial-reader-{name}", daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        return dict(self.counters)
+
+    def stop(self, timeout=1.0):
+        # The port read timeout bounds how long this takes
+        self._stopped = True
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                data = self.serial_conn.read(max(1, self.serial_conn.in_waiting))
+            except (OSError, TypeError) as e:
+                # TypeError is what pyserial raises on some platforms when the port is closed under it
+                if not self._stopped:
+                    log.error("Error reading from %s: %s", self.name, e)
+                    time.sleep(0.5)
+                continue
+            if data:
+                self.counters["bytes"] += len(data)
+                self._split_lines(data, time.monotonic())
+
+    def _split_lines(self, data, timestamp):
+        partial = self._partial
+        partial += data
+        start = 0
+        while True:
+            end = partial.find(b'\n', start)
+            if end < 0:
+                break
+            line = partial[start:end].decode('utf-8', errors='replace').strip()
+            start = end + 1
+            if line:
+                self._put(InputLine(self.name, line, timestamp))
+        del partial[:start]
+        if len(partial) > self.max_line_length:
+            # No newline in sight, the data is garbage (wrong baud rate, reset)
+            del partial[:]
+            self.counters["dropped"] += 1
+
+    def _put(self, input_line):
+        try:
+            self.input_queue.put_nowait(input_line)
+        except queue.Full:
+            self.counters["dropped"] += 1
+            return
+        self.counters["lines"] += 1
+        if self.on_line:
+            self.on_line()
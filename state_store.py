@@ -0,0 +1,80 @@
+import threading
+from collections import namedtuple
+
+# One published state of a key group. values and versions are never changed
+# after publishing, so a reader can use a snapshot for as long as it likes.
+# versions maps each key to the group version that last changed it.
+Snapshot = namedtuple("Snapshot", ["version", "values", "versions"])
+
+EMPTY = Snapshot(0, {}, {})
+
+
+class StateStore:
+    # Double-buffered state shared between the reader threads and the
+    # handlers. Writers stage values into the back buffer of a key group;
+    # commit() publishes them all at once as a new Snapshot with the next
+    # version, at DCS-BIOS frame end or at the end of a BMS tick. Readers
+    # only ever pick up the published Snapshot reference, which is a single
+    # atomic read, so the read path takes no lock and a frame never tears.
+    def __init__(self):
+        self.published = {}  # group -> Snapshot
+        self.staged = {}  # group -> {key: value} waiting for the next commit
+        self._lock = threading.Lock()  # Writers only
+
+    def define(self, group, values):
+        # Publishes the initial values of a group as version 0
+        with self._lock:
+            self.published[group] = Snapshot(0, dict(values), {key: 0 for key in values})
+            self.staged[group] = {}
+
+    def stage(self, group, key, value):
+        with self._lock:
+            self.staged.setdefault(group, {})[key] = value
+
+    def stage_first(self, group, key, value):
+        # Stages value unless key already has one waiting for this commit
+        with self._lock:
+            self.staged.setdefault(group, {}).setdefault(key, value)
+
+    def update(self, group, values):
+        with self._lock:
+            self.staged.setdefault(group, {}).update(values)
+
+    def commit(self, group):
+        # Returns the published version. Nothing is published when no staged
+        # value differs from the current one.
+        with self._lock:
+            staged = self.staged.get(group)
+            current = self.published.get(group, EMPTY)
+            if not staged:
+                return current.version
+            self.staged[group] = {}
+            changed = [key for key, value in staged.items()
+                       if key not in current.values
+                       or (current.values[key] is not value and current.values[key] != value)]
+            if not changed:
+                return current.version
+            version = current.version + 1
+            values = dict(current.values)
+            versions = dict(current.versions)
+            for key in changed:
+                values[key] = staged[key]
+                versions[key] = version
+            self.published[group] = Snapshot(version, values, versions)
+            return version
+
+    def snapshot(self, group):
+        return self.published.get(group, EMPTY)
+
+    def get(self, group, key, default=None):
+        return self.published.get(group, EMPTY).values.get(key, default)
+
+    def version(self, group):
+        return self.published.get(group, EMPTY).version
+
+    def changed_since(self, group, version, snapshot=None):
+        # {key: value} of everything committed after version, from one snapshot
+        snapshot = snapshot or self.snapshot(group)
+        if snapshot.version <= version:
+            return {}
+        return {key: snapshot.values[key] for key, key_version in snapshot.versions.items() if key_version > version}
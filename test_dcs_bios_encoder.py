@@ -0,0 +1,51 @@
+import json
+import random
+from types import SimpleNamespace
+
+from dcs_bios_reader import ProtocolParser, StringBuffer, IntegerBuffer
+from dcs_bios_encoder import ExportEncoder, StringBinding, IntegerBinding
+
+
+def test_encoder_output_round_trips_through_parser():
+    bindings = [
+        StringBinding(0x4500, 8, lambda sources: sources["FlightData"].line),
+        IntegerBinding(0x4400, 0xffff, 0, lambda sources: sources["FlightData"].rpm),
+        IntegerBinding(0x4402, 0x0100, 8, lambda sources: sources["FlightData"].light),
+    ]
+    encoder = ExportEncoder(bindings, refresh_interval=5.0)
+    parser = ProtocolParser()
+    decoded = {}
+    StringBuffer(parser, 0x4500, 8, lambda value: decoded.__setitem__("line", value))
+    IntegerBuffer(parser, 0x4400, 0xffff, 0, lambda value: decoded.__setitem__("rpm", value))
+    IntegerBuffer(parser, 0x4402, 0x0100, 8, lambda value: decoded.__setitem__("light", value))
+
+    rng = random.Random(1)
+    for tick in range(50):
+        # 0x55 bytes on purpose, the parser must not take them for a sync
+        data = SimpleNamespace(line=bytes(rng.choice(b"UU ABC,") for _ in range(rng.randint(0, 8))),
+                               rpm=rng.choice((0x5555, 0x55, rng.randrange(0x10000))),
+                               light=rng.randint(0, 1))
+        parser.feed(encoder.encode({"FlightData": data}, now=tick * 0.1))
+        assert decoded["line"] == data.line.decode("latin-1").ljust(8)
+        assert decoded["rpm"] == data.rpm
+        assert decoded["light"] == data.light
+
+
+def test_text_of_0x55_bytes_is_not_taken_for_a_sync():
+    encoder = ExportEncoder([StringBinding(0x4500, 12, lambda sources: sources["line"])])
+    parser = ProtocolParser()
+    decoded = []
+    StringBuffer(parser, 0x4500, 12, decoded.append)
+    parser.feed(encoder.encode({"line": b"UUUUUUUUUUUU"}, now=0.0))
+    assert decoded == ["UUUUUUUUUUUU"]
+
+
+def test_bad_bindings_are_skipped(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps([
+        {"address": "0x4400", "source": "FlightData.rpm", "range": [50, 50]},
+        {"address": "0x4402", "source": "FlightData.rpm", "range": [0, 110]},
+    ]))
+    encoder = ExportEncoder.from_file(str(path), refresh_interval=1.5)
+    assert [binding.address for binding in encoder.bindings] == [0x4402]
+    assert encoder.refresh_interval == 1.5
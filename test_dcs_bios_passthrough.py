@@ -0,0 +1,77 @@
+import random
+
+from dcs_bios_reader import ProtocolParser
+from dcs_bios_passthrough import (ExportForwarder, DeviceStream, SYNC, WRITE_HEADER, END_OF_UPDATE, WORD,
+                                  parse_address_ranges, split_run)
+
+
+class Capture:
+    # Stands in for an ArduinoConnection
+    def __init__(self):
+        self.data = bytearray()
+
+    def send_bytes(self, data, stamp=None):
+        self.data += data
+
+
+def mirror(parser):
+    # Export memory as rebuilt from the writes the parser decodes, plus the
+    # end-of-update values in order
+    memory = bytearray(0x10000)
+    end_of_updates = []
+
+    def on_write(address, data):
+        if address == END_OF_UPDATE:
+            end_of_updates.append(data)
+        WORD.pack_into(memory, address, data)
+    parser.write_callbacks.add(on_write)
+    return memory, end_of_updates
+
+
+def test_address_ranges_are_aligned_and_merged():
+    config = {"address_ranges": [["0x4501", 3], [0x4504, 2], [0x4600, 1]]}
+    assert parse_address_ranges(config) == [(0x4500, 0x4506), (0x4600, 0x4602)]
+
+
+def test_forwarder_output_reproduces_subscribed_ranges():
+    rng = random.Random(2)
+    source = ProtocolParser()
+    source_memory, _ = mirror(source)
+    inside = Capture()
+    outside = Capture()
+    ExportForwarder(source, [DeviceStream("DED", inside, [(0x4500, 0x4520)]),
+                             DeviceStream("OTHER", outside, [(0x6000, 0x6002)])])
+
+    frames = 20
+    for frame in range(frames):
+        stream = bytearray(SYNC)
+        for address in sorted(rng.sample(range(0x44f0, 0x4530, 2), 12)):
+            # 0x5555 on purpose, the forwarded stream must not look like a sync
+            stream += WRITE_HEADER.pack(address, 2) + WORD.pack(rng.choice((0x5555, rng.randrange(0x10000))))
+        stream += WRITE_HEADER.pack(END_OF_UPDATE, 2) + WORD.pack(frame)
+        source.feed(bytes(stream))
+
+    device = ProtocolParser()
+    device_memory, end_of_updates = mirror(device)
+    device.feed(bytes(inside.data))
+    assert device_memory[0x4500:0x4520] == source_memory[0x4500:0x4520]
+    # Nothing outside the subscribed range was forwarded
+    assert device_memory[0x44f0:0x4500] == bytes(0x10)
+    assert device_memory[0x4520:0x4530] == bytes(0x10)
+    assert end_of_updates == list(range(frames))
+
+    # Devices without writes still get one frame per update
+    other = ProtocolParser()
+    other_memory, other_end_of_updates = mirror(other)
+    other.feed(bytes(outside.data))
+    assert other_end_of_updates == list(range(frames))
+    assert other_memory[:END_OF_UPDATE] == bytes(END_OF_UPDATE)
+
+
+def test_runs_never_carry_a_sync():
+    data = bytes((0x01, 0x55, 0x55, 0x55, 0x55, 0x02, 0x55, 0x55, 0x55, 0x55, 0x55, 0x55))
+    pieces = list(split_run(0x4500, data))
+    assert b"".join(piece for _, piece in pieces) == data
+    assert [address for address, _ in pieces] == [0x4500, 0x4504, 0x4508, 0x450a]
+    for _, piece in pieces:
+        assert SYNC not in piece
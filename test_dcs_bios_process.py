@@ -0,0 +1,135 @@
+import random
+import socket
+import struct
+import threading
+import time
+
+from dcs_bios_reader import ProtocolParser, IntegerBuffer
+from dcs_bios_passthrough import SYNC, WRITE_HEADER, END_OF_UPDATE, WORD
+from dcs_bios_process import SharedRing, FrameCollector, DecoderProcess, RECORD_HEADER
+
+
+class Wakeup:
+    def __init__(self):
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+
+
+def test_ring_keeps_order_across_wraparound():
+    rng = random.Random(7)
+    ring = SharedRing.create(256)
+    try:
+        sent = []
+        received = []
+        for i in range(5000):
+            if rng.random() < 0.55:
+                payload = bytes(rng.randrange(256) for _ in range(rng.randrange(0, 60)))
+                if ring.put(payload, float(i)):
+                    sent.append((float(i), payload))
+            else:
+                record = ring.get()
+                if record is not None:
+                    received.append(record)
+        while True:
+            record = ring.get()
+            if record is None:
+                break
+            received.append(record)
+        assert received == sent
+        # Positions only grow, so the ring went round many times
+        assert ring.write_position.value > 20 * ring.capacity
+    finally:
+        ring.close()
+
+
+def test_ring_refuses_records_that_do_not_fit():
+    ring = SharedRing.create(128)
+    try:
+        payload = bytes(range(30))
+        stored = 0
+        while ring.put(payload, 1.0):
+            stored += 1
+        assert stored == 128 // (RECORD_HEADER.size + len(payload))
+        # Nothing stored was damaged by the refused put
+        assert ring.get() == (1.0, payload)
+        assert ring.put(payload, 2.0)
+        records = []
+        while True:
+            record = ring.get()
+            if record is None:
+                break
+            records.append(record)
+        assert records == [(1.0, payload)] * (stored - 1) + [(2.0, payload)]
+    finally:
+        ring.close()
+
+
+def test_collector_sends_changed_words_and_first_zeros():
+    ring = SharedRing.create(4096)
+    try:
+        wakeup = Wakeup()
+        collector = FrameCollector(ring, wakeup, refresh_interval=1000.0)
+        collector.on_write(0x4400, 0)
+        collector.on_write(0x4402, 7)
+        collector.on_write(END_OF_UPDATE, 1)
+        collector.on_write(0x4400, 0)
+        collector.on_write(0x4402, 8)
+        collector.on_write(END_OF_UPDATE, 2)
+        first = struct.unpack("<6H", ring.get()[1])
+        second = struct.unpack("<4H", ring.get()[1])
+        assert first == (0x4400, 0, 0x4402, 7, END_OF_UPDATE, 1)
+        assert second == (0x4402, 8, END_OF_UPDATE, 2)
+        assert wakeup.releases == 2
+    finally:
+        ring.close()
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_decoder_process_loopback():
+    port = free_port()
+    parser = ProtocolParser()
+    values = {}
+    for i in range(8):
+        IntegerBuffer(parser, 0x4400 + 2 * i, 0xffff, 0, lambda value, i=i: values.__setitem__(i, value))
+    frames = []
+    parser.add_address_callback(END_OF_UPDATE, 1, lambda address, data: frames.append(data))
+    stop = threading.Event()
+    decoder = DecoderProcess(parser, stop, {"dcs_bios": {"port": port}}, capacity=1 << 16, poll_interval=0.05)
+    decoder.start()
+    thread = threading.Thread(target=decoder.run)
+    thread.start()
+    try:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        expected = {}
+        deadline = time.monotonic() + 30.0
+        frame = 0
+        # Resend until the process has bound its socket and frames come through
+        while len(frames) < 100 and time.monotonic() < deadline:
+            expected = {i: (frame * 8 + i) & 0xffff for i in range(8)}
+            datagram = bytearray(SYNC)
+            for i, value in expected.items():
+                datagram += WRITE_HEADER.pack(0x4400 + 2 * i, 2) + WORD.pack(value)
+            datagram += WRITE_HEADER.pack(END_OF_UPDATE, 2) + WORD.pack(frame & 0xffff)
+            sender.sendto(bytes(datagram), ("127.0.0.1", port))
+            frame += 1
+            time.sleep(0.01)
+        sender.close()
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        thread.join()
+    assert len(frames) >= 100
+    assert frames == sorted(frames)
+    assert values == expected
+    stats = decoder.stats()
+    assert stats["dispatched_frames"] == len(frames)
+    assert stats["datagrams"] >= len(frames)
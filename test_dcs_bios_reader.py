@@ -0,0 +1,69 @@
+import random
+import struct
+
+from dcs_bios_reader import ProtocolParser, StringBuffer, IntegerBuffer
+
+
+def random_stream(rng, frames=5):
+    # Export frames heavy in 0x55 bytes: in data, in addresses, as runs of
+    # three and of four (a sync in the middle of a write), plus some noise
+    stream = bytearray()
+    for _ in range(frames):
+        stream += b"\x55" * 4
+        for _ in range(rng.randrange(1, 6)):
+            count = rng.randrange(1, 40) * 2
+            address = rng.choice((0x4400, 0x5554, 0x5555, rng.randrange(0x8000) * 2))
+            stream += struct.pack("<HH", address, count)
+            stream += bytes(rng.choice((0x55, 0x55, 0x00, 0x01, 0xaa)) for _ in range(count))
+        if rng.random() < 0.2:
+            stream += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 8)))
+        stream += struct.pack("<HHH", 0xfffe, 2, rng.randrange(0x10000))
+    return bytes(stream)
+
+
+def decode(stream, feed):
+    parser = ProtocolParser()
+    calls = []
+    parser.write_callbacks.add(lambda address, data: calls.append((address, data)))
+    parser.add_address_callback(0x4400, 80, lambda address, data: calls.append(("indexed", address, data)))
+    parser.frame_sync_callbacks.add(lambda: calls.append("sync"))
+    feed(parser, stream)
+    return calls
+
+
+def by_byte(parser, stream):
+    for b in stream:
+        parser.processByte(bytes((b,)))
+
+
+def test_feed_matches_process_byte_on_random_splits():
+    rng = random.Random(11)
+    for _ in range(300):
+        stream = random_stream(rng)
+        expected = decode(stream, by_byte)
+
+        def split_feed(parser, stream):
+            i = 0
+            while i < len(stream):
+                j = i + rng.randrange(1, 64)
+                chunk = stream[i:j]
+                # Both the bytes path and the in-place memoryview path
+                parser.feed(chunk if rng.random() < 0.5 else memoryview(bytearray(chunk)))
+                i = j
+        assert decode(stream, split_feed) == expected
+        assert decode(stream, lambda parser, data: parser.feed(data)) == expected
+
+
+def test_feed_decodes_buffers():
+    parser = ProtocolParser()
+    strings = []
+    integers = []
+    StringBuffer(parser, 0x4500, 6, strings.append)
+    IntegerBuffer(parser, 0x4400, 0x0f00, 8, integers.append)
+    frame = b"\x55" * 4 + struct.pack("<HH", 0x4500, 6) + b"UUUABC" + struct.pack("<HHH", 0x4400, 2, 0x0500)
+    frame += struct.pack("<HHH", 0xfffe, 2, 1)
+    receive_buffer = bytearray(64)
+    receive_buffer[:len(frame)] = frame
+    parser.feed(memoryview(receive_buffer)[:len(frame)])
+    assert strings == ["UUUABC"]
+    assert integers == [5]
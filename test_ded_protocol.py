@@ -0,0 +1,94 @@
+import random
+
+from ded_protocol import DEDFrameDecoder, DEDFrameEncoder, SYNC1, SYNC2, build_frame, OP_SET_CHARS
+
+ROWS = 5
+COLUMNS = 26
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .:/*,"
+
+
+def encoded_screen(encoder):
+    return [bytes(row).decode('latin-1') for row in encoder.screen]
+
+
+def test_round_trip_random_edits():
+    rng = random.Random(0)
+    encoder = DEDFrameEncoder(ROWS, COLUMNS)
+    decoder = DEDFrameDecoder(ROWS, COLUMNS)
+    lines = ["".join(rng.choice(ALPHABET) for _ in range(COLUMNS)) for _ in range(ROWS)]
+    now = 0.0
+    for _ in range(500):
+        now += 0.05
+        row = rng.randrange(ROWS)
+        line = list(lines[row])
+        for _ in range(rng.randint(1, 4)):
+            line[rng.randrange(COLUMNS)] = rng.choice(ALPHABET)
+        lines[row] = "".join(line)
+        decoder.feed(encoder.encode(lines, now))
+        assert decoder.lines() == lines
+    assert decoder.errors == 0
+    # Deltas went out between the keyframes
+    assert encoder.keyframes < encoder.frames
+
+
+def test_comma_inside_a_line():
+    # The text protocol splits on ",", the binary one must not care
+    encoder = DEDFrameEncoder(2, 16)
+    decoder = DEDFrameDecoder(2, 16)
+    lines = ["STPT 1,2,3", ",,LEADING"]
+    decoder.feed(encoder.encode(lines, 0.0))
+    assert [line.rstrip() for line in decoder.lines()] == lines
+    lines[1] = ",,LEADING,TRAIL,"
+    decoder.feed(encoder.encode(lines, 0.1))
+    assert [line.rstrip() for line in decoder.lines()] == lines
+
+
+def test_resync_after_garbage():
+    encoder = DEDFrameEncoder(ROWS, COLUMNS)
+    decoder = DEDFrameDecoder(ROWS, COLUMNS)
+    lines = ["LINE %d" % row for row in range(ROWS)]
+    # Noise, a lone SYNC1 and a header whose length covers the rest of the noise
+    decoder.feed(bytes((0x00, SYNC1, 0x13, SYNC1, SYNC1, SYNC2, 3, 0x42, 0x43, 0x44, 0x00)))
+    assert not decoder.synced
+    assert decoder.errors == 1
+    decoder.feed(encoder.encode(lines, 0.0))
+    assert decoder.synced
+    assert [line.rstrip() for line in decoder.lines()] == lines
+
+
+def test_corrupted_frame_is_consumed_whole():
+    # Like DedProtocol.h: a frame failing its checksum is skipped up to its
+    # checksum byte, and decoding starts over at the next SYNC1
+    encoder = DEDFrameEncoder(ROWS, COLUMNS)
+    decoder = DEDFrameDecoder(ROWS, COLUMNS)
+    decoder.feed(encoder.encode(["BEFORE"], 0.0))
+    corrupt = bytearray(build_frame(bytes((OP_SET_CHARS, 0, 0, 3)) + b"BAD"))
+    corrupt[-1] ^= 0xff
+    decoder.feed(bytes(corrupt))
+    assert decoder.errors == 1
+    assert decoder.lines()[0].startswith("BEFORE")
+    # The next frame right after it applies
+    decoder.feed(build_frame(bytes((OP_SET_CHARS, 0, 0, 3)) + b"NEW"))
+    assert decoder.lines()[0].startswith("NEWORE")
+
+
+def test_frame_inside_a_corrupted_frame_is_not_applied():
+    decoder = DEDFrameDecoder(ROWS, COLUMNS)
+    inner = build_frame(bytes((OP_SET_CHARS, 1, 0, 5)) + b"INNER")
+    outer = bytearray(build_frame(bytes((OP_SET_CHARS, 0, 0, len(inner))) + inner))
+    outer[-1] ^= 0xff
+    decoder.feed(bytes(outer))
+    assert decoder.frames == 0
+    assert decoder.errors == 1
+    assert decoder.lines()[1] == " " * COLUMNS
+
+
+def test_frame_split_across_feeds():
+    encoder = DEDFrameEncoder(ROWS, COLUMNS)
+    decoder = DEDFrameDecoder(ROWS, COLUMNS)
+    lines = ["SPLIT %d" % row for row in range(ROWS)]
+    data = encoder.encode(lines, 0.0)
+    for i in range(len(data)):
+        decoder.feed(data[i:i + 1])
+    assert decoder.lines() == encoded_screen(encoder)
+    assert decoder.frames == 1
@@ -0,0 +1,93 @@
+import json
+import os
+
+from file_cache import load_cached
+from keyfile_compiler import load_keyfile_index
+from dcs_bios_controls import ControlIndex
+
+
+class Builder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, content):
+        self.calls += 1
+        return content.decode().upper()
+
+
+def set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_warm_start_reuses_the_cache(tmp_path):
+    path = str(tmp_path / "source.txt")
+    open(path, "w").write("abc")
+    build = Builder()
+    assert load_cached(path, build, 1) == "ABC"
+    assert load_cached(path, build, 1) == "ABC"
+    assert build.calls == 1
+
+
+def test_changed_content_invalidates_the_cache(tmp_path):
+    path = str(tmp_path / "source.txt")
+    open(path, "w").write("abc")
+    set_mtime(path, 1_000_000_000)
+    build = Builder()
+    load_cached(path, build, 1)
+    # Same size, so only the mtime tells the edit apart
+    open(path, "w").write("xyz")
+    set_mtime(path, 2_000_000_000)
+    assert load_cached(path, build, 1) == "XYZ"
+    assert build.calls == 2
+
+
+def test_touched_file_keeps_the_cached_value(tmp_path):
+    path = str(tmp_path / "source.txt")
+    open(path, "w").write("abc")
+    set_mtime(path, 1_000_000_000)
+    build = Builder()
+    load_cached(path, build, 1)
+    set_mtime(path, 2_000_000_000)
+    assert load_cached(path, build, 1) == "ABC"
+    assert build.calls == 1
+    # The new mtime was stored, so the next start is a plain hit again
+    assert load_cached(path, build, 1) == "ABC"
+    assert build.calls == 1
+
+
+def test_version_key_and_corruption_invalidate_the_cache(tmp_path):
+    path = str(tmp_path / "source.txt")
+    open(path, "w").write("abc")
+    build = Builder()
+    load_cached(path, build, 1, key="a")
+    load_cached(path, build, 2, key="a")
+    assert build.calls == 2
+    load_cached(path, build, 2, key="b")
+    assert build.calls == 3
+    open(path + ".cache", "wb").write(b"not a pickle")
+    assert load_cached(path, build, 2, key="b") == "ABC"
+    assert build.calls == 4
+
+
+def test_keyfile_index_follows_the_keyfile_and_the_key_table(tmp_path):
+    path = str(tmp_path / "keyfile.key")
+    open(path, "w").write("SimICPSIX 122 0 0x07 0 0 0 1 \"ICP 6\"\n")
+    assert load_keyfile_index(path, {"0x07": "6"}).primary("SimICPSIX") == ("0x07", "0", "6")
+    # A stale table must not be served from the cache
+    assert load_keyfile_index(path, {"0x07": "F6"}).primary("SimICPSIX") == ("0x07", "0", "F6")
+    open(path, "w").write("SimICPSIX 122 0 0x08 0 0 0 1 \"ICP 6\"\n")
+    set_mtime(path, os.stat(path).st_mtime_ns + 1_000_000_000)
+    assert load_keyfile_index(path, {"0x08": "7"}).primary("SimICPSIX") == ("0x08", "0", "7")
+
+
+def test_control_index_follows_the_json(tmp_path):
+    path = str(tmp_path / "F-16C_50.json")
+
+    def write(address):
+        document = {"DED": {"DED_LINE_1": {"outputs": [{"type": "string", "address": address, "max_length": 29}]}}}
+        json.dump(document, open(path, "w"))
+    write(0x4500)
+    assert ControlIndex.load(path).get("DED_LINE_1").address == 0x4500
+    write(0x4600)
+    set_mtime(path, os.stat(path).st_mtime_ns + 1_000_000_000)
+    assert ControlIndex.load(path).get("DED_LINE_1").address == 0x4600
@@ -0,0 +1,21 @@
+import pytest
+
+from key_injector import KeyInjector, RecordingBackend, injector_backend_from_config
+
+
+def test_config_selects_the_recording_backend():
+    backend = injector_backend_from_config({"keys": {"injector_backend": "recording"}})
+    assert isinstance(backend, RecordingBackend)
+    injector = KeyInjector(backend, key_interval=0)
+    try:
+        assert injector.inject("shift+num 6")
+        injector.wait_idle()
+    finally:
+        injector.stop()
+    assert [chord for chord, _ in backend.events] == ["shift+num 6"]
+    assert injector.stats()["injected"] == 1
+
+
+def test_unknown_backend_is_refused():
+    with pytest.raises(ValueError):
+        injector_backend_from_config({"keys": {"injector_backend": "xinput"}})
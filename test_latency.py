@@ -0,0 +1,46 @@
+import random
+
+from latency import LatencyHistogram, LatencyTracer
+
+
+def test_percentiles_within_bucket_precision():
+    rng = random.Random(4)
+    values = [int(rng.lognormvariate(7, 1.5)) for _ in range(100000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for percent in (50, 90, 99, 99.9):
+        exact = values[max(0, int(len(values) * percent / 100.0 + 0.5) - 1)]
+        # Buckets are 2 / sub_buckets wide, about 3% with the defaults
+        assert abs(histogram.percentile(percent) - exact) <= max(1, exact * 2 / histogram.sub_buckets)
+    assert histogram.max == values[-1]
+    assert histogram.count == len(values)
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in range(64):
+        histogram.record(value)
+    assert histogram.percentile(50) == 31
+    assert histogram.percentile(100) == 63
+
+
+def test_bucket_bounds_cover_their_values():
+    histogram = LatencyHistogram()
+    for value in (64, 65, 127, 128, 1000, 123456, 2 ** 30):
+        index = histogram.index(value)
+        assert histogram.value_at(index - 1) < value <= histogram.value_at(index)
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = LatencyTracer()
+    assert tracer.mark("dcs") is None
+    tracer.record(None, "serial")
+    assert tracer.report() == {}
+    tracer.enabled = True
+    stamp = tracer.mark("dcs", now=1.0)
+    tracer.record(stamp, "serial", "DED", now=1.002)
+    (path, device), stats = next(iter(tracer.report().items()))
+    assert (path, device, stats["count"]) == ("dcs>serial", "DED", 1)
+    assert abs(stats["p50_ms"] - 2.0) < 0.1
@@ -0,0 +1,39 @@
+import logging
+import queue
+
+from log import RateLimitFilter, QueueingHandler
+
+
+def make_record(message, *args, exc_info=None):
+    return logging.LogRecord("middleware.test", logging.ERROR, __file__, 1, message, args, exc_info)
+
+
+def test_suppressed_record_keeps_no_arguments_or_exception():
+    limiter = RateLimitFilter(interval=60.0, burst=1)
+    try:
+        raise OSError("gone")
+    except OSError as e:
+        error = e
+        records = [make_record("Error opening '%s': %s", "area", error) for _ in range(3)]
+    assert [limiter.filter(record) for record in records] == [True, False, False]
+    summary, = limiter.flush(force=True)
+    assert summary.getMessage() == "Error opening 'area': gone"
+    assert summary.args is None
+    assert summary.exc_info is None
+    assert summary.suppressed[0] == 2
+
+
+def test_queued_record_is_prepared():
+    records = queue.Queue(maxsize=1)
+    handler = QueueingHandler(records)
+    try:
+        raise ValueError("bad")
+    except ValueError as e:
+        handler.handle(make_record("Failed: %s", e, exc_info=(type(e), e, e.__traceback__)))
+    record = records.get_nowait()
+    assert record.args is None and record.exc_info is None
+    assert record.getMessage().startswith("Failed: bad\nTraceback")
+    # A full queue drops instead of blocking
+    handler.handle(make_record("one"))
+    handler.handle(make_record("two"))
+    assert handler.dropped == 1
@@ -0,0 +1,60 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from key_injector import RecordingBackend
+from mapping_engine import MappingEngine, ACTION_NONE, ACTION_KEY, ACTION_AXIS, NO_ACTION
+
+ENTRIES = [
+    {"control": "ICP_BTN_6", "type": "button", "press": "SimICPSIX", "release": ""},
+    {"control": "ICP_DATA_UP_DN_SW", "type": "toggle", "positions": {"0": "SimICPDEDDOWN", "1": "", "2": "SimICPDEDUP"}},
+    {"control": "COMM1_VOL", "type": "rotary", "inc": "SimStepComm1VolumeUp", "dec": "SimStepComm1VolumeDown"},
+    {"control": "ICP_HUD_BRT_KNB", "type": "axis"},
+]
+
+
+def test_lookup_resolves_every_entry_type():
+    engine = MappingEngine(ENTRIES)
+    assert engine.lookup("ICP_BTN_6 1") == (ACTION_KEY, "SimICPSIX")
+    assert engine.lookup("ICP_BTN_6 0") == NO_ACTION
+    assert engine.lookup("ICP_DATA_UP_DN_SW 2") == (ACTION_KEY, "SimICPDEDUP")
+    assert engine.lookup("ICP_DATA_UP_DN_SW 1") == (ACTION_NONE,)
+    assert engine.lookup("COMM1_VOL INC") == (ACTION_KEY, "SimStepComm1VolumeUp")
+    assert engine.lookup("COMM1_VOL -3200") == (ACTION_KEY, "SimStepComm1VolumeDown")
+    assert engine.lookup("ICP_HUD_BRT_KNB 32768") == (ACTION_AXIS, "ICP_HUD_BRT_KNB", 32768)
+    assert engine.lookup("ICP_HUD_BRT_KNB garbage") is None
+    assert engine.lookup("ICP_BTN_6 7") is None
+    assert engine.lookup("UNKNOWN_CONTROL 1") is None
+
+
+def test_chords_replace_callbacks_and_report_unbound_ones():
+    engine = MappingEngine(ENTRIES, {"SimICPSIX": "num 6", "SimICPDEDUP": "ctrl+up"})
+    assert engine.lookup("ICP_BTN_6 1") == (ACTION_KEY, "num 6")
+    assert engine.lookup("ICP_DATA_UP_DN_SW 2") == (ACTION_KEY, "ctrl+up")
+    assert engine.lookup("ICP_DATA_UP_DN_SW 0") == NO_ACTION
+    assert sorted(engine.unresolved) == ["SimICPDEDDOWN", "SimStepComm1VolumeDown", "SimStepComm1VolumeUp"]
+
+
+def test_unknown_entry_type_is_refused():
+    with pytest.raises(ValueError):
+        MappingEngine([{"control": "ICP_BTN_6", "type": "lever"}])
+
+
+def test_shipped_tables_map_icp_btn_6_to_simicpsix(monkeypatch):
+    # mappings.json and keyfile.txt as shipped, through FalconBMSHandler.
+    # The keyfile binds SimICPSIX to scan code 0x4D (num 6) with modifier 1.
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    from BMSKeyHandler import FalconBMSHandler
+    backend = RecordingBackend()
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler = FalconBMSHandler(injector_backend=backend)
+    try:
+        assert handler.mappings.lookup("ICP_BTN_6 1") == (ACTION_KEY, "shift+num 6")
+        handler.send_key("ICP_BTN_6 1")
+        handler.send_key("ICP_BTN_6 0")
+        handler.injector.wait_idle()
+        assert [chord for chord, _ in backend.events] == ["shift+num 6"]
+    finally:
+        handler.injector.stop()
@@ -0,0 +1,132 @@
+import ctypes
+import mmap
+import struct
+
+import pytest
+
+from falcon_bms_reader import SharedMemoryReader, FlightData, FlightData2, IntellivibeData
+from recording import Recorder, Replayer, ReplayBackend, AREAS, FILE_HEADER, diff_runs, encode_delta, apply_delta
+
+
+class MemoryBackend:
+    # Anonymous mappings standing in for BMS's shared memory
+    def __init__(self):
+        self.areas = {}
+
+    def open(self, name, size):
+        if name not in self.areas:
+            self.areas[name] = mmap.mmap(-1, size)
+        return self.areas[name]
+
+
+def area_bytes(backend, structure):
+    return bytes(backend.areas[structure.name][:ctypes.sizeof(structure)])
+
+
+@pytest.fixture
+def recording(tmp_path):
+    # 10 s at 10 Hz: FlightData changes every tick, FlightData2 every second,
+    # IntellivibeData never; a datagram every tick. Returns the path and the
+    # FlightData bytes after each tick.
+    path = str(tmp_path / "flight.rec")
+    backend = MemoryBackend()
+    reader = SharedMemoryReader(backend)
+    recorder = Recorder(path, keyframe_interval=2.0)
+    states = []
+    for tick in range(100):
+        now = recorder.start + tick / 10.0
+        flightdata = reader.view(FlightData)
+        flightdata.rpm = tick
+        flightdata.kias = tick * 2.5
+        if tick % 10 == 0:
+            reader.view(FlightData2).cabinAlt = tick
+        del flightdata
+        reader.view(IntellivibeData)
+        recorder.record_snapshots(reader, now)
+        recorder.record_datagram(struct.pack("<H", tick), now)
+        states.append({structure: area_bytes(backend, structure) for structure in AREAS})
+    stats = recorder.stats()
+    recorder.close()
+    reader.close()
+    return path, states, stats
+
+
+def test_unchanged_areas_cost_nothing(recording):
+    path, states, stats = recording
+    assert stats["datagrams"] == 100
+    # Every 2 s a keyframe of all three areas, otherwise only deltas of what changed
+    assert stats["keyframes"] == 5 * 3
+    assert stats["unchanged"] > 0
+
+
+def test_replay_matches_byte_for_byte(recording):
+    path, states, stats = recording
+    replayer = Replayer(path)
+    backend = ReplayBackend()
+    datagrams = []
+    replayed = []
+
+    def on_snapshot(structure):
+        if structure is FlightData:
+            replayed.append(bytes(backend.area(0)))
+    replayer.play(lambda data: datagrams.append(struct.unpack("<H", data)[0]), backend, on_snapshot, speed=0)
+    replayer.close()
+    assert datagrams == list(range(100))
+    assert replayed == [state[FlightData] for state in states]
+    for index, structure in enumerate(AREAS):
+        assert bytes(backend.area(index)) == states[-1][structure]
+
+
+def test_seek_restores_the_state(recording):
+    path, states, stats = recording
+    replayer = Replayer(path)
+    assert len(replayer.build_index()) == 5
+    backend = ReplayBackend()
+    played = []
+
+    def on_datagram(data):
+        # Each tick's datagram follows its snapshots, so the areas are complete here
+        played.append((struct.unpack("<H", data)[0], [bytes(backend.area(index)) for index in range(len(AREAS))]))
+    replayer.play(on_datagram, backend, speed=0, start=5.0)
+    replayer.close()
+    tick, areas = played[0]
+    assert tick in (50, 51)  # Timestamps are floats relative to the start
+    for index, structure in enumerate(AREAS):
+        assert areas[index] == states[tick][structure]
+    assert [tick for tick, _ in played] == list(range(played[0][0], 100))
+
+
+def test_mismatched_layout_is_refused(recording, tmp_path):
+    path, states, stats = recording
+    data = bytearray(open(path, "rb").read())
+    struct.pack_into("<I", data, FILE_HEADER.size, ctypes.sizeof(FlightData) + 8)
+    other = tmp_path / "other.rec"
+    other.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        Replayer(str(other))
+
+
+def test_delta_round_trip():
+    old = bytes(range(256)) * 4
+    new = bytearray(old)
+    new[3] = 0
+    new[500:520] = bytes(20)
+    new[-1] = 7
+    target = bytearray(old)
+    apply_delta(target, encode_delta(diff_runs(old, bytes(new)), bytes(new)))
+    assert target == new
+
+
+def test_datagram_only_recording_can_seek(tmp_path):
+    path = str(tmp_path / "dcs.rec")
+    recorder = Recorder(path, keyframe_interval=1.0)
+    for tick in range(50):
+        recorder.record_datagram(struct.pack("<H", tick), recorder.start + tick / 10.0)
+    recorder.close()
+    replayer = Replayer(path)
+    assert len(replayer.build_index()) == 5
+    assert replayer.seek_offset(2.55) > replayer.seek_offset(1.0) > replayer.seek_offset(0.0)
+    played = []
+    replayer.play(lambda data: played.append(struct.unpack("<H", data)[0]), speed=0, start=2.55)
+    replayer.close()
+    assert played == list(range(26, 50))
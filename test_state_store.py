@@ -0,0 +1,59 @@
+import threading
+
+from state_store import StateStore
+
+
+def test_commit_publishes_only_changes():
+    store = StateStore()
+    store.define("DCS", {"DED_line1": "", "DED_line2": ""})
+    store.stage("DCS", "DED_line1", "STPT 1")
+    assert store.get("DCS", "DED_line1") == ""  # Not published before the commit
+    assert store.commit("DCS") == 1
+    store.stage("DCS", "DED_line1", "STPT 1")
+    assert store.commit("DCS") == 1  # Same value, no new version
+    store.update("DCS", {"DED_line2": "MAN"})
+    assert store.commit("DCS") == 2
+    assert store.changed_since("DCS", 1) == {"DED_line2": "MAN"}
+    assert store.changed_since("DCS", 0) == {"DED_line1": "STPT 1", "DED_line2": "MAN"}
+    assert store.changed_since("DCS", 2) == {}
+
+
+def test_stage_first_keeps_the_first_value():
+    store = StateStore()
+    store.define("DCS", {"DED_stamp": None})
+    store.stage_first("DCS", "DED_stamp", 1)
+    store.stage_first("DCS", "DED_stamp", 2)
+    store.commit("DCS")
+    assert store.get("DCS", "DED_stamp") == 1
+
+
+def test_concurrent_reader_never_sees_a_torn_frame():
+    # The writer stages both DED lines of a frame one after the other, like
+    # the DCS-BIOS callbacks do; a reader must see both lines of one frame
+    store = StateStore()
+    store.define("DCS", {"DED_line1": "0", "DED_line2": "0"})
+    frames = 3000
+    torn = []
+    versions = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            snapshot = store.snapshot("DCS")
+            if snapshot.values["DED_line1"] != snapshot.values["DED_line2"]:
+                torn.append(snapshot)
+            versions.append(snapshot.version)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for frame in range(1, frames + 1):
+            store.stage("DCS", "DED_line1", str(frame))
+            store.stage("DCS", "DED_line2", str(frame))
+            store.commit("DCS")
+    finally:
+        done.set()
+        reader.join()
+    assert not torn
+    assert store.version("DCS") == frames
+    assert versions == sorted(versions)